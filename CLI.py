@@ -4,7 +4,9 @@ built using urwid, a console user interface library for Python.
 """
 
 
+from bisect import bisect_left
 from math import floor
+import os.path
 import threading
 import time
 import urwid
@@ -16,6 +18,18 @@ def exit_hibiki_cb(*args):
     raise urwid.ExitMainLoop()
 
 
+def format_duration(seconds):
+    """Formats the number of seconds as HH:MM:SS."""
+    seconds = floor(seconds)
+    return '{:02d}:{:02d}:{:02d}'.format(seconds // 3600, seconds % 3600 // 60,
+                                         seconds % 60)
+
+
+def format_throughput(throughput):
+    """Formats the number of bytes per second as megabytes per second."""
+    return '{:.1f} MB/s'.format(throughput / (1024 * 1024))
+
+
 def generate_hotkeys(hotkeys):
     """Generates hotkey help text for footer from strings by displaying the
     first character of the string with different styling.
@@ -49,6 +63,7 @@ class HibikiCLI(object):
         self.body = None
         self.clock_running = True
         self.loop = None
+        self.rebuild = False
         self.setting_index = 0
         self.start_time = 0
 
@@ -133,11 +148,7 @@ class HibikiCLI(object):
         until the application is terminated..
         """
         if self.clock_running:
-            elapsed = floor(time.time() - self.start_time)
-            self.clock.set_text('{:02d}:{:02d}:{:02d}'
-                                .format(elapsed // 3600,
-                                        elapsed % 3600 // 60,
-                                        elapsed % 60))
+            self.clock.set_text(format_duration(time.time() - self.start_time))
             loop.set_alarm_in(1, self.refresh_clock_cb)
 
     def start_clock(self):
@@ -218,15 +229,25 @@ class CopyScreen(urwid.ListBox):
         self.current_text.set_text(self.format_track(track, 1))
         self.processed += 1
         self.update_statusbar()
+        self.update_title('COPYING')
 
-    def after_delete(self, data):
-        """Callback method after a track is deleted. Adds an information line
-        for the deleted track.
+    def after_delete(self, paths):
+        """Callback method after a batch of files is deleted. Adds an
+        information line for the deleted file or, if the batch contains more
+        than one file, for the whole batch.
         """
-        if isinstance(data, hibiki.iTunesTrack):
-            text = self.format_track(data, 2)
+        if len(paths) == 1:
+            text = paths[0]
         else:
-            text = self.format_text(data, 2)
+            directory = os.path.dirname(paths[0]) or '.'
+            text = '{} ({} files)'.format(directory, len(paths))
+        self.add_text(self.format_text(text, 2))
+
+    def after_rename(self, old, new):
+        """Callback method after a file is renamed on the destination. Adds an
+        information line for the renamed file.
+        """
+        text = self.format_text('{} -> {}'.format(old, new), 3)
         self.add_text(text)
 
     def before_copy(self, track):
@@ -246,10 +267,10 @@ class CopyScreen(urwid.ListBox):
                 text = '(file not found) '
             elif error.args[0] == 28:
                 text = '(insufficient space) '
-        if isinstance(data, hibiki.iTunesTrack):
-            data_text = self.format_track(data, 2)
-        else:
+        if isinstance(data, str):
             data_text = self.format_text(data, 2)
+        else:
+            data_text = self.format_track(data, 2)
         self.current_text.set_text([text, data_text])
         self.errors += 1
         self.update_statusbar()
@@ -271,6 +292,9 @@ class CopyScreen(urwid.ListBox):
         elif state == 2:
             prefix = 'del'
             state_text = ('error', ' > ')
+        elif state == 3:
+            prefix = 'mov'
+            state_text = ('success', ' > ')
         width = max(3, len(str(self.item_count)))
         return ['{prefix:>{width}}'.format(prefix=prefix, width=width),
                 state_text, text]
@@ -304,35 +328,54 @@ class CopyScreen(urwid.ListBox):
             exit_hibiki_cb()
 
     def run(self):
-        """Main logic of the command-line application. It generates a list of
-        the items to be synced and then starts the copying process, attaching
-        the after_copy and before_copy methods as callbacks.
-        """
+        """Main logic of the command-line application. It rebuilds the library
+        file from the destination contents if it was asked for in the
+        settings, generates a list of the items to be synced and then starts
+        the copying process, attaching the after_copy and before_copy methods
+        as callbacks.
+        """
+        if self.parent.rebuild:
+            self.parent.title.set_text('REBUILDING LIBRARY')
+            self.parent.hibiki.rebuild_library()
         self.parent.title.set_text('PREPARING COPY')
         self.parent.hibiki.generate_sync_list(
             delete_callback=self.after_delete,
-            error_callback=self.error
+            error_callback=self.error,
+            rename_callback=self.after_rename
         )
         self.parent.title.set_text('COPYING')
         self.item_count = len(self.parent.hibiki.tracks)
         self.parent.hibiki.copy_tracks(before_callback=self.before_copy,
                                        after_callback=self.after_copy,
                                        error_callback=self.error,
-                                       end_signal=self.quit)
+                                       end_signal=lambda: self.quit)
         self.parent.title.set_text('FINISHED')
         self.parent.clock_running = False
+        phases = self.parent.hibiki.metrics.phases
+        self.add_text(', '.join('{} {:.1f}s'.format(name, phases[name])
+                                for name in phases))
 
     def update_statusbar(self):
         """Sets the status bar text to the current number of processed items
-        and total item count."""
+        and total item count, the error count and the estimated time remaining.
+        """
+        text = '{s.processed}/{s.item_count} copied'.format(s=self)
         if self.errors > 0:
-            text = ('{s.processed}/{s.item_count} copied, {s.errors} errors'
-                    .format(s=self))
-        else:
-            text = ('{s.processed}/{s.item_count} copied'
-                    .format(s=self))
+            text += ', {s.errors} errors'.format(s=self)
+        eta = self.parent.hibiki.metrics.eta
+        if eta is not None:
+            text += ', ETA {}'.format(format_duration(eta))
         self.status_text.set_text(text)
 
+    def update_title(self, title):
+        """Sets the header title with the current copy throughput appended if
+        it is known.
+        """
+        throughput = self.parent.hibiki.metrics.throughput
+        if throughput:
+            title = '{} {}'.format(title, format_throughput(throughput))
+        self.parent.title.set_text(title)
+
 
 class LoadingOverlay(urwid.Overlay):
     """Simple loading bar with animated dots to avoid frozen interface."""
@@ -364,22 +407,159 @@ class LoadingOverlay(urwid.Overlay):
         loop.set_alarm_in(0.5, self.update_cb)
 
 
+class PrefixIndex(object):
+    """Sorted index of the case-folded words of a list of strings, used for
+    finding the strings where any word starts with a given prefix.
+    """
+
+    def __init__(self, items):
+        keys = []
+        for position, item in enumerate(items):
+            words = item.casefold().split()
+            for number in range(len(words)):
+                keys.append((' '.join(words[number:]), position))
+        keys.sort()
+        self.keys = [x[0] for x in keys]
+        self.positions = [x[1] for x in keys]
+
+    def search(self, prefix):
+        """Returns a sorted list of the positions of the strings matching the
+        case-folded prefix.
+        """
+        prefix = ' '.join(prefix.casefold().split())
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\U0010ffff', lo=start)
+        return sorted(set(self.positions[start:end]))
+
+
 class SelectionOption(object):
     """Class used with SelectionPrompt to provide data and methods for the
-    particular screens.
+    particular screens. items is a callable returning the list of the choices,
+    which is only called when the screen is opened.
     """
 
     def __init__(self, title=None, items=None, add_method=None, source=None):
         self.add_method = add_method
-        self.items = items
+        self.get_items = items
         self.title = title
         self.source = source
 
+        self._index = None
+        self._items = None
+
+    @property
+    def index(self):
+        """Returns a PrefixIndex of the items, built on first access."""
+        if self._index is None:
+            self._index = PrefixIndex(self.items)
+        return self._index
+
+    @property
+    def items(self):
+        """Returns the list of the choices, fetched on first access."""
+        if self._items is None:
+            self._items = self.get_items()
+        return self._items
+
     def add(self, value):
         """Alias for the add_method."""
         self.add_method(value)
 
 
+class SelectionWalker(urwid.ListWalker):
+    """List walker for the choices of a SelectionOption. Checkboxes are only
+    created for the rows urwid asks for and the states are kept in the
+    self.selected set, so that long lists don't create a widget for every
+    choice. The visible rows can be limited with a filter.
+    """
+
+    CACHE_SIZE = 256
+
+    def __init__(self, option, selected, callback=None):
+        self.callback = callback
+        self.focus = 0
+        self.option = option
+        self.query = ''
+        self.selected = selected
+        self.visible = range(len(option.items))
+
+        self._widgets = {}
+
+    def __len__(self):
+        return len(self.visible)
+
+    def _change_cb(self, widget, state):
+        """Records the new state of the checkbox."""
+        if state:
+            self.selected.add(widget.get_label())
+        else:
+            self.selected.discard(widget.get_label())
+        if self.callback:
+            self.callback()
+
+    def _widget(self, position):
+        """Returns the checkbox widget for the visible row, creating it if it
+        isn't cached.
+        """
+        item = self.visible[position]
+        if item not in self._widgets:
+            if len(self._widgets) >= self.CACHE_SIZE:
+                self._widgets.clear()
+            choice = self.option.items[item]
+            box = urwid.CheckBox(choice, state=choice in self.selected)
+            urwid.connect_signal(box, 'change', self._change_cb)
+            self._widgets[item] = urwid.AttrMap(box, None,
+                                                focus_map='reversed')
+        return self._widgets[item]
+
+    def clear(self):
+        """Unchecks all of the choices."""
+        self.selected.clear()
+        self._widgets.clear()
+        self._modified()
+
+    def get_focus(self):
+        """Returns the focused checkbox and its position."""
+        if not self.visible:
+            return None, None
+        return self._widget(self.focus), self.focus
+
+    def get_next(self, position):
+        """Returns the checkbox after the position and its position."""
+        if position + 1 >= len(self.visible):
+            return None, None
+        return self._widget(position + 1), position + 1
+
+    def get_prev(self, position):
+        """Returns the checkbox before the position and its position."""
+        if position <= 0:
+            return None, None
+        return self._widget(position - 1), position - 1
+
+    def positions(self, reverse=False):
+        """Returns the positions of the visible rows in order."""
+        if reverse:
+            return range(len(self.visible) - 1, -1, -1)
+        return range(len(self.visible))
+
+    def set_filter(self, query):
+        """Limits the visible rows to the choices with a word starting with
+        the query. An empty query shows all the choices.
+        """
+        self.query = query
+        if query.strip():
+            self.visible = self.option.index.search(query)
+        else:
+            self.visible = range(len(self.option.items))
+        self.focus = 0
+        self._modified()
+
+    def set_focus(self, position):
+        """Moves the focus onto the visible row in the position."""
+        self.focus = position
+        self._modified()
+
+
 class SelectionPrompt(urwid.ListBox):
     """Class used to display and save the include/exclude settings in Hibiki CLI.
     """
@@ -387,10 +567,9 @@ class SelectionPrompt(urwid.ListBox):
     def __init__(self, parent):
         self.parent = parent
 
+        self.filtering = False
         self.index = 0
-        self.item_count = 0
         self.options = []
-        self.selected = 0
 
         self._init_footer()
         self._init_options()
@@ -399,20 +578,13 @@ class SelectionPrompt(urwid.ListBox):
         super().__init__(self.body)
         self.generate_checkboxes()
 
-    @property
-    def checkboxes(self):
-        """Generates all the checkboxes present in the widget by returning the
-        original_widget attributes from the self.body AttrMaps.
-        """
-        for wrap in self.body:
-            yield wrap.original_widget
-
     def _init_footer(self):
         """Initializes the footer with the help texts and status bar and then
         sets it as the footer in the parent object.
         """
         self.status_text = urwid.Text('')
-        key_help = generate_hotkeys(['skip', 'continue', 'reset', 'quit'])
+        key_help = generate_hotkeys(['/filter', 'skip', 'continue', 'reset',
+                                     'quit'])
         widgets = [self.status_text] + key_help
         footer = urwid.Padding(urwid.Columns(widgets, dividechars=2),
                                left=1, right=1)
@@ -420,7 +592,8 @@ class SelectionPrompt(urwid.ListBox):
 
     def _init_options(self):
         """Initializes the option screen data and attempts to load the includes
-        and excludes from file.
+        and excludes from file. The choices of a screen are fetched from the
+        library only when the screen is opened.
         """
         try:
             self.parent.hibiki.config.includes.load_from_file()
@@ -430,71 +603,93 @@ class SelectionPrompt(urwid.ListBox):
             self.parent.hibiki.config.excludes.load_from_file()
         except (FileNotFoundError, hibiki.exceptions.InvalidConfigError):
             pass
+        itunes = self.parent.hibiki.itunes
         options = [['INCLUDE ARTISTS',
-                    self.parent.hibiki.itunes.all_artists,
+                    lambda: itunes.all_artists,
                     self.parent.hibiki.config.includes.add_artist,
                     self.parent.hibiki.config.includes.artists],
                    ['INCLUDE ALBUMS',
-                    self.parent.hibiki.itunes.all_albums,
+                    lambda: itunes.all_albums,
                     self.parent.hibiki.config.includes.add_album,
                     self.parent.hibiki.config.includes.albums],
                    ['INCLUDE GENRES',
-                    self.parent.hibiki.itunes.all_genres,
+                    lambda: itunes.all_genres,
                     self.parent.hibiki.config.includes.add_genre,
                     self.parent.hibiki.config.includes.genres],
                    ['INCLUDE PLAYLISTS',
-                    self.parent.hibiki.itunes.all_playlists,
+                    lambda: itunes.all_playlists,
                     self.parent.hibiki.config.includes.add_playlist,
                     self.parent.hibiki.config.includes.playlists],
                    ['EXCLUDE ARTISTS',
-                    self.parent.hibiki.itunes.all_artists,
+                    lambda: itunes.all_artists,
                     self.parent.hibiki.config.excludes.add_artist,
                     self.parent.hibiki.config.excludes.artists],
                    ['EXCLUDE ALBUMS',
-                    self.parent.hibiki.itunes.all_albums,
+                    lambda: itunes.all_albums,
                     self.parent.hibiki.config.excludes.add_album,
                     self.parent.hibiki.config.excludes.albums],
                    ['EXCLUDE GENRES',
-                    self.parent.hibiki.itunes.all_genres,
+                    lambda: itunes.all_genres,
                     self.parent.hibiki.config.excludes.add_genre,
                     self.parent.hibiki.config.excludes.genres],
                    ['EXCLUDE PLAYLISTS',
-                    self.parent.hibiki.itunes.all_playlists,
+                    lambda: itunes.all_playlists,
                     self.parent.hibiki.config.excludes.add_playlist,
                     self.parent.hibiki.config.excludes.playlists]]
         for kwargs in options:
             option = SelectionOption(*kwargs)
             self.options.append(option)
 
+    def filter_keypress(self, key):
+        """Edits the filter query while filtering. Enter keeps the filter and
+        escape clears it, both ending the filtering. Returns True if the key
+        was handled.
+        """
+        if key == 'enter':
+            self.filtering = False
+        elif key == 'esc':
+            self.filtering = False
+            self.body.set_filter('')
+        elif key == 'backspace':
+            self.body.set_filter(self.body.query[:-1])
+        elif len(key) == 1 and key.isprintable():
+            self.body.set_filter(self.body.query + key)
+        else:
+            return False
+        self.update_statusbar_cb()
+        return True
+
     def generate_checkboxes(self):
-        """Generates a list of checkboxes based on the self.options and
-        self.index. If the self.index is out of range, the open_copy() method
-        is called from parent to continue application execution.
+        """Sets a SelectionWalker for the current option in self.options as
+        the list body. The choices found in the option source are checked. If
+        the self.index is out of range, the open_copy() method is called from
+        parent to continue application execution.
         """
         try:
             options = self.options[self.index]
         except IndexError:
             self.parent.open_copy()
             return
-        self.item_count = len(options.items)
         self.parent.title.set_text(options.title)
-        self.body.clear()
-        for choice in options.items:
-            box = urwid.CheckBox(choice)
-            if choice in options.source:
-                self.selected += 1
-                box.set_state(True)
-            urwid.connect_signal(box, 'change', self.update_statusbar_cb)
-            self.body.append(urwid.AttrMap(box, None, focus_map='reversed'))
+        selected = set(options.source).intersection(options.items)
         options.source.clear()
+        self.filtering = False
+        self.body = SelectionWalker(options, selected,
+                                    callback=self.update_statusbar_cb)
         self.update_statusbar_cb()
 
     def keypress(self, size, key):
         """Overrides the default keypress() method in urwid.ListBox to capture
         the custom keypresses. If the pressed key is not one of the custom
-        keys, the original keypress function is called instead.
+        keys, the original keypress function is called instead. While
+        filtering, the typed characters are added to the filter.
         """
-        if key == 'c':
+        if self.filtering and self.filter_keypress(key):
+            return
+        if key == '/':
+            self.filtering = True
+            self.update_statusbar_cb()
+        elif key == 'c':
             self.save()
         elif key == 'q':
             exit_hibiki_cb()
@@ -506,20 +701,19 @@ class SelectionPrompt(urwid.ListBox):
             super().keypress(size, key)
 
     def reset_list(self):
-        """Iterates through the checkboxes and sets all of the states to False.
-        """
-        for checkbox in self.checkboxes:
-            checkbox.set_state(False)
+        """Unchecks all of the choices in the current list."""
+        self.body.clear()
+        self.update_statusbar_cb()
 
     def save(self):
         """Saves the include/exclude settings after user decides to continue
         from one list.
         """
-        for checkbox in self.checkboxes:
-            if checkbox.state:
-                self.options[self.index].add(checkbox.get_label())
+        option = self.options[self.index]
+        for choice in option.items:
+            if choice in self.body.selected:
+                option.add(choice)
         self.index += 1
-        self.selected = 0
         self.generate_checkboxes()
 
     def skip(self):
@@ -527,25 +721,26 @@ class SelectionPrompt(urwid.ListBox):
         the include/exclude lists are cleared in the generate_checkboxes method
         and only get a value again during the save method.
         """
-        while True:
-            try:
-                self.save()
-            except IndexError:
-                break
+        while self.index < len(self.options):
+            self.save()
 
     def update_statusbar_cb(self, widget=None, state=None):
-        """Updates the number of selected items in the footer."""
-        if state is True:
-            self.selected += 1
-        elif state is False:
-            self.selected -= 1
-        self.status_text.set_text('{s.selected}/{s.item_count} items selected'
-                                  .format(s=self))
+        """Updates the number of selected items and the filter in the footer.
+        """
+        text = '{}/{} items selected'.format(len(self.body.selected),
+                                             len(self.body.option.items))
+        if self.filtering or self.body.query:
+            text += '  /{}{}'.format(self.body.query,
+                                     '_' if self.filtering else '')
+            text += ' ({} shown)'.format(len(self.body))
+        self.status_text.set_text(text)
 
 
 class SettingsPrompt(urwid.Overlay):
     """Overlay for the initial settings for Hibiki CLI."""
 
+    PRIORITIES = [None] + sorted(hibiki.priority.POLICIES)
+
     def __init__(self, parent):
         self.parent = parent
         self.config = parent.hibiki.config
@@ -553,15 +748,19 @@ class SettingsPrompt(urwid.Overlay):
         self.cancel_button = None
         self.destination = None
         self.itunes_path = None
+        self.layout = None
         self.max_file_count = None
+        self.policy = None
+        self.priority = None
         self.random_fill = None
+        self.rebuild = None
         self.reset_button = None
         self.save_button = None
         self.use_subfolders = None
 
         super().__init__(self.body(), urwid.SolidFill(),
                          align='center', width=('relative', 90),
-                         valign='middle', height=9)
+                         valign='middle', height=12)
 
     def body(self):
         """Initializes the body by pulling a list containing return values from
@@ -574,6 +773,9 @@ class SettingsPrompt(urwid.Overlay):
                  self.random_fill_prompt(),
                  self.use_subfolders_prompt(),
                  self.max_file_count_prompt(),
+                 self.priority_prompt(),
+                 self.layout_prompt(),
+                 self.rebuild_prompt(),
                  urwid.Divider(),
                  self.button_row()]
         listing = urwid.ListBox(urwid.SimpleFocusListWalker(items))
@@ -622,6 +824,8 @@ class SettingsPrompt(urwid.Overlay):
             self.use_subfolders.set_state(self.config.use_subfolders)
             self.random_fill.set_state(self.config.random_fill)
             self.max_file_count.set_edit_text(str(self.config.max_file_count))
+            self.set_priority(self.config.priority)
+            self.layout.set_edit_text(self.config.layout or '')
 
     def itunes_path_prompt(self):
         """Generates an iTunes Library.xml path prompt."""
@@ -629,6 +833,14 @@ class SettingsPrompt(urwid.Overlay):
         self.itunes_path = urwid.Edit(caption=' ', edit_text='')
         return urwid.Columns([('pack', label), self.itunes_path])
 
+    def layout_prompt(self):
+        """Generates a path template prompt. An empty template keeps the
+        file names of the source files.
+        """
+        label = urwid.Text(('input_label', ' PATH TEMPLATE '))
+        self.layout = urwid.Edit(caption=' ', edit_text='')
+        return urwid.Columns([('pack', label), self.layout])
+
     def max_file_count_prompt(self):
         """Generates a max file count prompt that only accepts integers."""
         label = urwid.Text(('input_label', ' MAX FILE COUNT PER SUBFODLER '))
@@ -636,6 +848,28 @@ class SettingsPrompt(urwid.Overlay):
         return urwid.Columns([('pack', label), self.max_file_count],
                              dividechars=1)
 
+    def priority_prompt(self):
+        """Generates a priority policy button that cycles through the
+        policies when clicked.
+        """
+        label = urwid.Text(('input_label', ' PRIORITY '))
+        self.priority = urwid.Button('')
+        urwid.connect_signal(self.priority, 'click', self.cycle_priority_cb)
+        self.set_priority(None)
+        return urwid.Columns([('pack', label), self.priority],
+                             dividechars=1)
+
+    def cycle_priority_cb(self, *args):
+        """Selects the next priority policy."""
+        policies = SettingsPrompt.PRIORITIES
+        index = policies.index(self.policy)
+        self.set_priority(policies[(index + 1) % len(policies)])
+
+    def set_priority(self, policy):
+        """Sets the priority policy and shows it on the priority button."""
+        self.policy = policy
+        self.priority.set_label(policy or 'library order')
+
     def random_fill_prompt(self):
         """Generates a random fill checkbox."""
         label = urwid.Text(('input_label', ' USE RANDOM FILL '))
@@ -643,6 +877,16 @@ class SettingsPrompt(urwid.Overlay):
         return urwid.Columns([('pack', label), self.random_fill],
                              dividechars=1)
 
+    def rebuild_prompt(self):
+        """Generates a checkbox for rebuilding the library file from the files
+        found on the destination before syncing. It isn't saved into the
+        configuration.
+        """
+        label = urwid.Text(('input_label', ' REBUILD LIBRARY FILE '))
+        self.rebuild = urwid.CheckBox('')
+        return urwid.Columns([('pack', label), self.rebuild],
+                             dividechars=1)
+
     def reset_configuration(self, reset_destination=True):
         """Resets the configuration. Optionally reset_destination can be set to
         false to keep it from reseting, which is useful for the
@@ -654,6 +898,9 @@ class SettingsPrompt(urwid.Overlay):
         self.use_subfolders.set_state(False)
         self.random_fill.set_state(False)
         self.max_file_count.set_edit_text('')
+        self.set_priority(None)
+        self.layout.set_edit_text('')
+        self.rebuild.set_state(False)
 
     def save_config_cb(self, *args):
         """Copies the values from the prompts and saves the configuration file.
@@ -661,9 +908,12 @@ class SettingsPrompt(urwid.Overlay):
         self.config.destination = self.destination.edit_text
         self.config.itunes_path = self.itunes_path.edit_text
         self.config.max_file_count = self.max_file_count.value()
+        self.config.priority = self.policy
+        self.config.layout = self.layout.edit_text or None
         self.config.random_fill = self.random_fill.get_state()
         self.config.use_subfolders = self.use_subfolders.get_state()
         self.config.save_config_file()
+        self.parent.rebuild = self.rebuild.get_state()
         self.parent.open_selection()
 
     def use_subfolders_prompt(self):
@@ -0,0 +1,4 @@
+"""
+Benchmark suite for hibiki using generated iTunes libraries. Run with
+`python -m benchmarks.run` from the repository root.
+"""
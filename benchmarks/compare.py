@@ -0,0 +1,45 @@
+"""
+Compares two benchmark result files written by benchmarks.run.
+"""
+
+import argparse
+import json
+
+
+def load_results(path):
+    """Returns the results in the file as a dictionary keyed by track count
+    and phase.
+    """
+    with open(path, 'r') as file:
+        data = json.load(file)
+    return {(x['tracks'], x['phase']): x['seconds'] for x in data['results']}
+
+
+def main(argv=None):
+    """Prints the timings of both result files and their ratio for every
+    benchmark found in both. Returns a non-zero exit status if any benchmark
+    got slower than the threshold allows.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('base', help='results of the baseline commit')
+    parser.add_argument('new', help='results of the compared commit')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='ratio above which a benchmark is a regression')
+    args = parser.parse_args(argv)
+
+    base = load_results(args.base)
+    new = load_results(args.new)
+    regressions = 0
+    for key in sorted(set(base) & set(new)):
+        ratio = new[key] / base[key] if base[key] else float('inf')
+        flag = ''
+        if ratio > args.threshold:
+            flag = ' REGRESSION'
+            regressions += 1
+        print('{:>9} tracks  {:<12} {:10.4f}s {:10.4f}s {:7.2f}x{}'.format(
+            key[0], key[1], base[key], new[key], ratio, flag))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,137 @@
+"""
+Generates synthetic iTunes Library.xml files and matching dummy media files
+for benchmarking.
+"""
+
+import os
+import os.path
+import random
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+GENRES = ['Alternative', 'Blues', 'Classical', 'Electronic', 'Hip-Hop',
+          'Jazz', 'Metal', 'Pop', 'Rock', 'Soundtrack']
+HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple Computer//DTD PLIST 1.0//EN" \
+"http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+\t<key>Major Version</key><integer>1</integer>
+\t<key>Minor Version</key><integer>1</integer>
+\t<key>Date</key><date>2015-06-01T12:00:00Z</date>
+\t<key>Application Version</key><string>11.4</string>
+\t<key>Features</key><integer>5</integer>
+\t<key>Show Content Ratings</key><true/>
+\t<key>Music Folder</key><string>{music_folder}</string>
+\t<key>Library Persistent ID</key><string>{persistent_id}</string>
+\t<key>Tracks</key>
+\t<dict>
+'''
+TRACK = '''\t\t<key>{track_id}</key>
+\t\t<dict>
+\t\t\t<key>Track ID</key><integer>{track_id}</integer>
+\t\t\t<key>Name</key><string>{name}</string>
+\t\t\t<key>Artist</key><string>{artist}</string>
+\t\t\t<key>Album Artist</key><string>{artist}</string>
+\t\t\t<key>Album</key><string>{album}</string>
+\t\t\t<key>Genre</key><string>{genre}</string>
+\t\t\t<key>Kind</key><string>MPEG audio file</string>
+\t\t\t<key>Size</key><integer>{size}</integer>
+\t\t\t<key>Total Time</key><integer>{time}</integer>
+\t\t\t<key>Disc Number</key><integer>1</integer>
+\t\t\t<key>Disc Count</key><integer>1</integer>
+\t\t\t<key>Track Number</key><integer>{track_number}</integer>
+\t\t\t<key>Track Count</key><integer>12</integer>
+\t\t\t<key>Year</key><integer>{year}</integer>
+\t\t\t<key>Date Modified</key><date>2015-01-{day:02d}T10:00:00Z</date>
+\t\t\t<key>Date Added</key><date>2014-12-{day:02d}T10:00:00Z</date>
+\t\t\t<key>Bit Rate</key><integer>320</integer>
+\t\t\t<key>Sample Rate</key><integer>44100</integer>
+\t\t\t<key>Play Count</key><integer>{play_count}</integer>
+\t\t\t<key>Play Date UTC</key><date>2015-05-{day:02d}T10:00:00Z</date>
+\t\t\t<key>Rating</key><integer>{rating}</integer>
+\t\t\t<key>Persistent ID</key><string>{persistent_id}</string>
+\t\t\t<key>Track Type</key><string>File</string>
+\t\t\t<key>Location</key><string>{location}</string>
+\t\t\t<key>File Folder Count</key><integer>5</integer>
+\t\t\t<key>Library Folder Count</key><integer>1</integer>
+\t\t</dict>
+'''
+PLAYLIST = '''\t\t<dict>
+\t\t\t<key>Name</key><string>{name}</string>
+\t\t\t<key>Playlist ID</key><integer>{playlist_id}</integer>
+\t\t\t<key>Playlist Persistent ID</key><string>{persistent_id}</string>
+\t\t\t<key>All Items</key><true/>
+\t\t\t<key>Playlist Items</key>
+\t\t\t<array>
+'''
+PLAYLIST_ITEM = ('\t\t\t\t<dict>\n\t\t\t\t\t<key>Track ID</key>'
+                 '<integer>{track_id}</integer>\n\t\t\t\t</dict>\n')
+FOOTER = '\t</array>\n</dict>\n</plist>\n'
+
+
+def file_url(path):
+    """Returns the path as a file URL in the format used by iTunes."""
+    return 'file://localhost' + quote(path)
+
+
+def generate_library(path, music_folder, track_count, playlist_count=20,
+                     file_size=4096, create_files=True, seed=0):
+    """Writes an iTunes Library.xml file with track_count tracks and
+    playlist_count playlists into path, referencing media files of roughly
+    file_size bytes in music_folder. The media files are created if
+    create_files is True. Every file has a unique size and roughly one in fifty
+    tracks references the same file as the previous track. Returns a list of
+    the generated track IDs.
+    """
+    rng = random.Random(seed)
+    artist_count = max(1, track_count // 100)
+    track_ids = []
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(HEADER.format(music_folder=file_url(music_folder + '/'),
+                                 persistent_id='B0A1C2D3E4F56789'))
+        location = None
+        for index in range(track_count):
+            track_id = 1000 + index * 2
+            artist = 'Artist {}'.format(rng.randrange(artist_count))
+            album = '{} Album {}'.format(artist, rng.randrange(10))
+            track_number = index % 12 + 1
+            if location is None or rng.random() >= 0.02:
+                size = file_size + index
+                directory = os.path.join(music_folder, artist, album)
+                location = os.path.join(
+                    directory, '{:02d} Track {}.mp3'.format(track_number,
+                                                            index))
+                if create_files:
+                    os.makedirs(directory, exist_ok=True)
+                    with open(location, 'wb') as media:
+                        media.write(str(index).encode())
+                        media.truncate(size)
+            file.write(TRACK.format(
+                track_id=track_id,
+                name=escape('Track {}'.format(index)),
+                artist=escape(artist),
+                album=escape(album),
+                genre=rng.choice(GENRES),
+                size=size,
+                time=rng.randrange(120000, 420000),
+                track_number=track_number,
+                year=rng.randrange(1960, 2016),
+                day=rng.randrange(1, 29),
+                play_count=rng.randrange(100),
+                rating=rng.randrange(6) * 20,
+                persistent_id='{:016X}'.format(index + 1),
+                location=escape(file_url(location))))
+            track_ids.append(track_id)
+        file.write('\t</dict>\n\t<key>Playlists</key>\n\t<array>\n')
+        for index in range(playlist_count):
+            file.write(PLAYLIST.format(
+                name='Playlist {}'.format(index),
+                playlist_id=100000 + index,
+                persistent_id='{:016X}'.format(0xF000000000000000 + index)))
+            count = min(len(track_ids), rng.randrange(10, 500))
+            for track_id in rng.sample(track_ids, count):
+                file.write(PLAYLIST_ITEM.format(track_id=track_id))
+            file.write('\t\t\t</array>\n\t\t</dict>\n')
+        file.write(FOOTER)
+    return track_ids
@@ -0,0 +1,176 @@
+"""
+Runs the hibiki benchmarks against generated libraries and writes the results
+as JSON, which can be compared across commits with benchmarks.compare.
+"""
+
+import argparse
+import json
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from hibiki import Hibiki, HibikiConfig, MemoryBackend
+from .library import generate_library
+
+PHASES = ['load', 'facets', 'plan', 'delete', 'copy', 'space', 'rebuild',
+          'random_fill', 'rotate']
+MEMORY_CAPACITY = 1024 ** 4
+
+
+def default_workdir():
+    """Returns a tmpfs directory for the benchmark files if available."""
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def git_revision():
+    """Returns the current git commit hash or None if it is not available."""
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+def timed(results, track_count, phase, function, *args, backend=None):
+    """Runs the function with the arguments and appends the elapsed time to
+    the results. With a MemoryBackend, the time it simulated is included.
+    Returns the return value of the function.
+    """
+    simulated = backend.elapsed if backend else 0
+    start = time.perf_counter()
+    value = function(*args)
+    results.append({'tracks': track_count, 'phase': phase,
+                    'seconds': time.perf_counter() - start})
+    if backend:
+        results[-1]['simulated_seconds'] = backend.elapsed - simulated
+    print('{:>9} tracks  {:<12} {:10.4f}s'.format(
+        track_count, phase, results[-1]['seconds']), file=sys.stderr)
+    return value
+
+
+def load_facets(hibiki):
+    """Lists all the albums, artists, genres and playlists in the library."""
+    library = hibiki.itunes
+    return (library.all_albums, library.all_artists, library.all_genres,
+            library.all_playlists)
+
+
+def benchmark(track_count, workdir, args):
+    """Generates a library with track_count tracks and times the sync phases.
+    With the memory backend, the destination is kept in a MemoryBackend and
+    the media files are not created. Returns a list of result dictionaries.
+    """
+    results = []
+    root = tempfile.mkdtemp(prefix='hibiki-benchmark-', dir=workdir)
+    try:
+        music = os.path.join(root, 'music')
+        destination = os.path.join(root, 'destination')
+        os.makedirs(music)
+        os.makedirs(os.path.join(destination, '.hibiki'))
+        path = os.path.join(root, 'iTunes Library.xml')
+        generate_library(path, music, track_count,
+                         playlist_count=args.playlists,
+                         file_size=args.file_size,
+                         create_files='copy' in args.phases and
+                         args.backend == 'local')
+
+        config = HibikiConfig(destination)
+        config.itunes_path = path
+        backend = None
+        if args.backend == 'memory':
+            backend = MemoryBackend(destination, MEMORY_CAPACITY,
+                                    latency=args.latency,
+                                    throughput=args.throughput * 1024 * 1024
+                                    if args.throughput else None)
+        hibiki = timed(results, track_count, 'load', Hibiki, config)
+        if backend:
+            hibiki.backend = backend
+        if 'facets' in args.phases:
+            timed(results, track_count, 'facets', load_facets, hibiki)
+
+        artists = hibiki.itunes.all_artists
+        selection = artists[:max(1, int(len(artists) * args.fraction))]
+        for artist in selection:
+            config.includes.add_artist(artist)
+        config.includes.add_playlist('Playlist 0')
+        timed(results, track_count, 'plan', hibiki._plan_sync_list,
+              backend=backend)
+        timed(results, track_count, 'delete', hibiki._clean_sync_list,
+              backend=backend)
+        if 'copy' in args.phases:
+            timed(results, track_count, 'copy', hibiki.copy_tracks,
+                  backend=backend)
+        if 'space' in args.phases:
+            timed(results, track_count, 'space', hibiki.calculate_space,
+                  backend=backend)
+        if 'rebuild' in args.phases:
+            timed(results, track_count, 'rebuild', hibiki.rebuild_library,
+                  backend=backend)
+        if 'random_fill' in args.phases:
+            config.random_fill = True
+            timed(results, track_count, 'random_fill',
+                  hibiki._plan_sync_list, backend=backend)
+            config.random_fill = False
+        if 'rotate' in args.phases:
+            config.includes.clear()
+            for artist in artists[len(selection):len(selection) * 2]:
+                config.includes.add_artist(artist)
+            hibiki._plan_sync_list()
+            timed(results, track_count, 'rotate', hibiki._clean_sync_list,
+                  backend=backend)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    """Parses the command-line arguments and runs the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tracks', type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help='library sizes to benchmark')
+    parser.add_argument('--playlists', type=int, default=20,
+                        help='number of playlists in the library')
+    parser.add_argument('--file-size', type=int, default=4096,
+                        help='approximate size of the dummy media files')
+    parser.add_argument('--fraction', type=float, default=0.1,
+                        help='fraction of artists included in the sync')
+    parser.add_argument('--phases', nargs='+', default=PHASES,
+                        choices=PHASES, help='optional phases to run')
+    parser.add_argument('--backend', default='local',
+                        choices=['local', 'memory'],
+                        help='destination backend to sync onto')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='simulated seconds per memory backend operation')
+    parser.add_argument('--throughput', type=float,
+                        help='simulated memory backend throughput in MB/s')
+    parser.add_argument('--workdir', default=default_workdir(),
+                        help='directory for the generated files')
+    parser.add_argument('--output', help='file to write the JSON results to')
+    args = parser.parse_args(argv)
+
+    results = []
+    for track_count in args.tracks:
+        results.extend(benchmark(track_count, args.workdir, args))
+    data = {'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'results': results}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(data, file, indent=2)
+    else:
+        json.dump(data, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
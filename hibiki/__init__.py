@@ -5,6 +5,15 @@ iTunes.
 """
 
 from .exceptions import BadDestinationError, InvalidConfigError
+from .backends import DestinationBackend, LocalBackend, MemoryBackend
 from .core import Hibiki
 from .config import HibikiConfig
+from .diff import LibraryDiff, LibrarySnapshot
+from .directory import DirectorySource, DirectoryTrack
+from .events import (CopyDoneEvent, CopyStartEvent, DeleteEvent, ErrorEvent,
+                     PlanEvent, RenameEvent, SyncEvent)
+from .metrics import SyncMetrics
+from .multi import HibikiGroup
 from .itunes import iTunesLibrary, iTunesPlaylist, iTunesTrack
+from .sources import LibrarySource, open_library
+from .watch import LibraryWatcher
@@ -0,0 +1,7 @@
+"""
+Runs the non-interactive command-line interface with `python -m hibiki`.
+"""
+
+from .headless import main
+
+raise SystemExit(main())
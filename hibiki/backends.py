@@ -0,0 +1,410 @@
+"""
+Provides the backends that perform the file operations on the destination,
+so that the sync engine can run against something else than the local file
+system.
+"""
+
+from collections import Counter, namedtuple
+import errno
+import os
+import os.path
+import threading
+import time
+from .capacity import filesystem_type
+from .dedup import file_hash
+from .scan import scan_directory, scan_tree
+from .transfer import copy_file, link_file
+
+FileSystemStats = namedtuple('FileSystemStats', ('f_bsize', 'f_frsize',
+                                                 'f_blocks', 'f_bfree',
+                                                 'f_bavail'))
+FileSystemStats.__doc__ = """File system statistics with the fields of
+os.statvfs() that are used for planning syncs.
+"""
+
+
+class DestinationBackend(object):
+    """Base class for the backends that perform the file operations on the
+    destination. The paths given to the methods are full paths in the
+    destination, except for the source paths, which are always on the local
+    file system. Errors are raised as OSError like with the functions of the
+    os module. The files of the .hibiki folder are not handled by the backend.
+    """
+
+    def copy_file(self, source, destinations, size=None, policy=None):
+        """Copies the source file into all of the destination paths like
+        transfer.copy_file() and returns a dictionary of the failed
+        destination paths and their exceptions. size is the expected size of
+        the source file and policy the CopyPolicy for the copy.
+        """
+        raise NotImplementedError
+
+    def exists(self, path):
+        """Returns True if a file or a directory exists in the path."""
+        raise NotImplementedError
+
+    def file_hash(self, path):
+        """Returns the SHA-1 hex digest of the contents of the file."""
+        raise NotImplementedError
+
+    def filesystem_type(self, path):
+        """Returns the type of the file system the path is on, or None if it
+        cannot be determined.
+        """
+        raise NotImplementedError
+
+    def isdir(self, path):
+        """Returns True if the path is an existing directory."""
+        raise NotImplementedError
+
+    def link_file(self, source, destination):
+        """Materializes the source in the destination path without copying
+        its data like transfer.link_file(). Returns 'reflink' or 'hardlink',
+        or None if the file has to be copied instead.
+        """
+        raise NotImplementedError
+
+    def listdir(self, path):
+        """Returns a list of the names of the entries in the directory."""
+        raise NotImplementedError
+
+    def makedirs(self, path):
+        """Creates the directory and its parents if they don't exist yet."""
+        raise NotImplementedError
+
+    def remove(self, path):
+        """Removes the file."""
+        raise NotImplementedError
+
+    def rename(self, source, destination):
+        """Renames the file, replacing any file in the destination path."""
+        raise NotImplementedError
+
+    def rmdir(self, path):
+        """Removes the directory. Raises OSError if it isn't empty."""
+        raise NotImplementedError
+
+    def scan_directory(self, path):
+        """Returns a tuple containing a dictionary of the file names and
+        sizes and a list of the subdirectory paths found directly in the path,
+        like scan.scan_directory(). Entries starting with '.' are ignored.
+        """
+        raise NotImplementedError
+
+    def scan_tree(self, root):
+        """Returns a dictionary of the relative file paths and sizes of the
+        files in the directory tree under root, like scan.scan_tree().
+        Entries starting with '.' are ignored.
+        """
+        raise NotImplementedError
+
+    def size(self, path):
+        """Returns the size of the file in bytes."""
+        raise NotImplementedError
+
+    def statvfs(self, path):
+        """Returns the statistics of the file system the path is on, with at
+        least the f_bavail, f_bsize and f_frsize fields of os.statvfs().
+        """
+        raise NotImplementedError
+
+
+class LocalBackend(DestinationBackend):
+    """Backend for destinations on the local file system, including any file
+    system mounted on it. The operations are passed to the os module and the
+    copy routines of the transfer module.
+    """
+
+    def copy_file(self, source, destinations, size=None, policy=None):
+        return copy_file(source, destinations, policy=policy)
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def file_hash(self, path):
+        return file_hash(path)
+
+    def filesystem_type(self, path):
+        return filesystem_type(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def link_file(self, source, destination):
+        return link_file(source, destination)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def makedirs(self, path):
+        os.makedirs(path, exist_ok=True)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def rename(self, source, destination):
+        os.rename(source, destination)
+
+    def rmdir(self, path):
+        os.rmdir(path)
+
+    def scan_directory(self, path):
+        return scan_directory(path)
+
+    def scan_tree(self, root):
+        return scan_tree(root)
+
+    def size(self, path):
+        return os.stat(path).st_size
+
+    def statvfs(self, path):
+        return os.statvfs(path)
+
+
+class MemoryBackend(DestinationBackend):
+    # pylint: disable=too-many-instance-attributes
+    """Backend that keeps the destination in memory, for testing and
+    benchmarking the sync engine independently of the disks. The destination
+    has room for capacity bytes in clusters of cluster_size bytes and reports
+    the given file system type. Every operation takes latency seconds and
+    copies are written at throughput bytes per second, or at the bandwidth
+    limit of the CopyPolicy if that is lower. The time is only simulated and
+    added to self.elapsed unless sleep is True, so that results don't depend
+    on the speed of the machine; the number of operations of every kind is
+    counted in self.operations.
+
+    Only the sizes of the files are stored. Copies take the size of the
+    source from the size argument without reading the source, so the source
+    files don't need to exist, and files can't be linked. Hashes of the files
+    are calculated from the source files they were copied from. The root
+    directory is created with the backend, and other destinations sharing the
+    backend need to be created with makedirs().
+    """
+
+    def __init__(self, root, capacity, cluster_size=4096, filesystem=None,
+                 latency=0, throughput=None, sleep=False):
+        self.capacity = capacity
+        self.cluster_size = cluster_size
+        self.elapsed = 0.0
+        self.filesystem = filesystem
+        self.latency = latency
+        self.operations = Counter()
+        self.sleep = sleep
+        self.throughput = throughput
+
+        self._children = {}
+        self._files = {}
+        self._lock = threading.Lock()
+        self._used = 0
+
+        self._make_directory(os.path.normpath(root))
+
+    @property
+    def used(self):
+        """Returns the number of bytes used by the files."""
+        return self._used
+
+    def _clusters(self, size):
+        """Returns the number of bytes a file of the given size takes up."""
+        return -(-size // self.cluster_size) * self.cluster_size
+
+    def _operation(self, name, seconds=0):
+        """Counts the operation and spends the latency and the given number
+        of seconds on it.
+        """
+        seconds += self.latency
+        with self._lock:
+            self.operations[name] += 1
+            self.elapsed += seconds
+        if self.sleep and seconds:
+            time.sleep(seconds)
+
+    def _directory(self, path):
+        """Returns the set of the entry names in the directory. Raises
+        OSError if the path isn't a directory.
+        """
+        if path in self._children:
+            return self._children[path]
+        if path in self._files:
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR),
+                                     path)
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+    def _make_directory(self, path):
+        """Creates the directory and its parents."""
+        if path in self._children:
+            return
+        if path in self._files:
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST),
+                                  path)
+        parent, name = os.path.split(path)
+        if name:
+            self._make_directory(parent)
+            self._children[parent].add(name)
+        self._children[path] = set()
+
+    def _file(self, path):
+        """Returns a (size, source) tuple of the file. Raises OSError if the
+        path isn't a file.
+        """
+        if path in self._files:
+            return self._files[path]
+        if path in self._children:
+            raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR),
+                                    path)
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+    def _unlink(self, path):
+        """Removes the file from the destination."""
+        size, _ = self._files.pop(path)
+        self._used -= self._clusters(size)
+        parent, name = os.path.split(path)
+        self._children[parent].discard(name)
+
+    def copy_file(self, source, destinations, size=None, policy=None):
+        if size is None:
+            size = os.path.getsize(source)
+        rate = self.throughput
+        if policy is not None and policy.limiter is not None:
+            rate = min(rate or policy.limiter.rate, policy.limiter.rate)
+        errors = {}
+        written = 0
+        with self._lock:
+            for path in destinations:
+                path = os.path.normpath(path)
+                try:
+                    parent, name = os.path.split(path)
+                    self._directory(parent)
+                    if path in self._children:
+                        self._file(path)
+                    freed = 0
+                    if path in self._files:
+                        freed = self._clusters(self._files[path][0])
+                    if self._used - freed + self._clusters(size) > \
+                            self.capacity:
+                        raise OSError(errno.ENOSPC,
+                                      os.strerror(errno.ENOSPC), path)
+                except OSError as error:
+                    errors[path] = error
+                    continue
+                if path in self._files:
+                    self._unlink(path)
+                self._files[path] = (size, source)
+                self._children[parent].add(name)
+                self._used += self._clusters(size)
+                written += size
+        self._operation('copy', written / rate if rate else 0)
+        return errors
+
+    def exists(self, path):
+        self._operation('stat')
+        path = os.path.normpath(path)
+        with self._lock:
+            return path in self._files or path in self._children
+
+    def file_hash(self, path):
+        self._operation('read')
+        with self._lock:
+            _, source = self._file(os.path.normpath(path))
+        return file_hash(source)
+
+    def filesystem_type(self, path):
+        return self.filesystem
+
+    def isdir(self, path):
+        self._operation('stat')
+        with self._lock:
+            return os.path.normpath(path) in self._children
+
+    def link_file(self, source, destination):
+        self._operation('link')
+        return None
+
+    def listdir(self, path):
+        self._operation('listdir')
+        with self._lock:
+            return sorted(self._directory(os.path.normpath(path)))
+
+    def makedirs(self, path):
+        self._operation('mkdir')
+        with self._lock:
+            self._make_directory(os.path.normpath(path))
+
+    def remove(self, path):
+        self._operation('remove')
+        path = os.path.normpath(path)
+        with self._lock:
+            self._file(path)
+            self._unlink(path)
+
+    def rename(self, source, destination):
+        self._operation('rename')
+        source = os.path.normpath(source)
+        destination = os.path.normpath(destination)
+        with self._lock:
+            entry = self._file(source)
+            parent, name = os.path.split(destination)
+            self._directory(parent)
+            if destination in self._children:
+                self._file(destination)
+            if destination in self._files:
+                self._unlink(destination)
+            self._unlink(source)
+            self._files[destination] = entry
+            self._children[parent].add(name)
+            self._used += self._clusters(entry[0])
+
+    def rmdir(self, path):
+        self._operation('rmdir')
+        path = os.path.normpath(path)
+        with self._lock:
+            if self._directory(path):
+                raise OSError(errno.ENOTEMPTY, os.strerror(errno.ENOTEMPTY),
+                              path)
+            del self._children[path]
+            parent, name = os.path.split(path)
+            if name and parent in self._children:
+                self._children[parent].discard(name)
+
+    def scan_directory(self, path):
+        self._operation('listdir')
+        path = os.path.normpath(path)
+        files = {}
+        directories = []
+        with self._lock:
+            for name in self._directory(path):
+                if name[0] == '.':
+                    continue
+                child = os.path.join(path, name)
+                if child in self._children:
+                    directories.append(child)
+                else:
+                    files[name] = self._files[child][0]
+        return files, directories
+
+    def scan_tree(self, root):
+        root = os.path.normpath(root)
+        results = {}
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            files, directories = self.scan_directory(directory)
+            relative = os.path.relpath(directory, root)
+            for name, size in files.items():
+                results[os.path.normpath(os.path.join(relative,
+                                                      name))] = size
+            pending.extend(directories)
+        return results
+
+    def size(self, path):
+        self._operation('stat')
+        with self._lock:
+            return self._file(os.path.normpath(path))[0]
+
+    def statvfs(self, path):
+        self._operation('statfs')
+        blocks = self.capacity // self.cluster_size
+        with self._lock:
+            free = blocks - self._used // self.cluster_size
+        return FileSystemStats(self.cluster_size, self.cluster_size, blocks,
+                               free, free)
@@ -0,0 +1,97 @@
+"""
+Provides a model of how much space files really take up on the destination
+file system, used for planning syncs that fit onto the destination.
+"""
+
+import math
+import os
+import os.path
+import re
+from .constants import (DIRECTORY_ENTRY_SIZE, EXFAT_MAX_DIRECTORY_ENTRIES,
+                        FAT_MAX_DIRECTORY_ENTRIES, MOUNTS_PATH)
+
+
+def _unescape(field):
+    """Decodes the octal escapes used for spaces and other special characters
+    in the fields of the mounts file.
+    """
+    return re.sub(r'\\([0-7]{3})', lambda x: chr(int(x.group(1), 8)), field)
+
+
+def filesystem_type(path, mounts=MOUNTS_PATH):
+    """Returns the type of the file system the path is on as listed in the
+    mounts file, or None if it cannot be determined.
+    """
+    path = os.path.realpath(path)
+    found = None
+    try:
+        with open(mounts, 'r') as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = _unescape(fields[1])
+                if os.path.commonpath([path, mount_point]) != mount_point:
+                    continue
+                if found is None or len(mount_point) >= len(found[0]):
+                    found = (mount_point, fields[2])
+    except (OSError, ValueError):
+        return None
+    return found[1] if found else None
+
+
+class CapacityModel(object):
+    """Models the space used by files on the file system of a destination.
+    File sizes are rounded up to whole clusters, taken from statvfs. On FAT
+    and exFAT file systems, the directory entries of the files are counted
+    against the space and the number of entries per directory is limited.
+    The file system is queried through the DestinationBackend in backend, a
+    LocalBackend by default.
+    """
+
+    def __init__(self, path, filesystem=None, backend=None):
+        if backend is None:
+            from .backends import LocalBackend
+            backend = LocalBackend()
+        stats = backend.statvfs(path)
+        self.cluster_size = stats.f_frsize or stats.f_bsize
+        self.filesystem = filesystem or backend.filesystem_type(path)
+
+    @property
+    def max_entries(self):
+        """Returns the maximum number of directory entries in one directory,
+        or None if the file system has no practical limit.
+        """
+        if self.filesystem in ('msdos', 'vfat'):
+            return FAT_MAX_DIRECTORY_ENTRIES
+        if self.filesystem == 'exfat':
+            return EXFAT_MAX_DIRECTORY_ENTRIES
+        return None
+
+    def cost(self, size, name):
+        """Returns the number of bytes a file of the given size and name takes
+        up on the destination.
+        """
+        clusters = math.ceil(size / self.cluster_size)
+        return clusters * self.cluster_size + self.entry_size(name)
+
+    def entries(self, name):
+        """Returns the number of directory entries used by a file name. FAT
+        uses an extra entry for every 13 characters of a long file name and
+        exFAT one for every 15 characters in addition to the two entries of
+        every file.
+        """
+        length = len(name.encode('utf-16-le')) // 2
+        if self.filesystem in ('msdos', 'vfat'):
+            return 1 + math.ceil(length / 13)
+        if self.filesystem == 'exfat':
+            return 2 + math.ceil(length / 15)
+        return 1
+
+    def entry_size(self, name):
+        """Returns the number of bytes used by the directory entries of a file
+        name, or 0 on file systems where they are not stored in the same way.
+        """
+        if self.max_entries is None:
+            return 0
+        return self.entries(name) * DIRECTORY_ENTRY_SIZE
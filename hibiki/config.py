@@ -4,7 +4,14 @@ Provides a configuration class for the Hibiki module.
 
 import os.path
 import json
-from .constants import DEFAULT_CONFIG_FILE_PATH, DEFAULT_LIBRARY_FILE_PATH
+from .constants import (DEFAULT_CONFIG_FILE_PATH, DEFAULT_FILES_FILE_PATH,
+                        DEFAULT_FINGERPRINT_FILE_PATH, DEFAULT_FSYNC_INTERVAL,
+                        DEFAULT_HISTORY_FILE_PATH, DEFAULT_LIBRARY_FILE_PATH,
+                        DEFAULT_SCAN_CACHE_FILE_PATH,
+                        DEFAULT_SNAPSHOT_FILE_PATH, FSYNC_POLICIES,
+                        TRANSFER_MODES)
+from .layout import Layout
+from .priority import POLICIES
 
 
 class HibikiConfig(object):
@@ -12,17 +19,29 @@ class HibikiConfig(object):
 
     def __init__(self, destination=None, parent=None):
         self._destination = None
+        self._files_path = None
+        self._history_path = None
         self._library_path = None
 
         self.destination = destination
         self.parent = parent
 
+        self.bandwidth_limit = None
         self.excludes = HibikiConfigFilters(self, filename='excludes')
+        self.fsync = 'none'
+        self.fsync_interval = DEFAULT_FSYNC_INTERVAL
         self.includes = HibikiConfigFilters(self, filename='includes')
         self.itunes_path = None
+        self.layout = None
         self.max_file_count = 0
+        self.memory_limit = None
+        self.parse_workers = None
+        self.priority = None
+        self.profile = None
         self.random_fill = False
+        self.transfer_mode = 'copy'
         self.use_subfolders = False
+        self.validate_sources = False
 
     @property
     def config_exists(self):
@@ -44,6 +63,37 @@ class HibikiConfig(object):
         """Returns the destination drive for the config."""
         return self._destination
 
+    @property
+    def fingerprint_path(self):
+        """Returns the path where the fingerprint of the last complete sync
+        is saved.
+        """
+        return os.path.join(self.destination, DEFAULT_FINGERPRINT_FILE_PATH)
+
+    @property
+    def files_path(self):
+        """Returns the path to the file where the sizes of the synced files are
+        cached. Generates a blank file if it doesn't exist before.
+        """
+        if not self._files_path:
+            self._files_path = os.path.join(self.destination,
+                                            DEFAULT_FILES_FILE_PATH)
+            if not os.path.isfile(self._files_path):
+                open(self._files_path, 'a').close()
+        return self._files_path
+
+    @property
+    def history_path(self):
+        """Returns the path to the file where the times the tracks were last
+        synced are recorded. Generates a blank file if it doesn't exist before.
+        """
+        if not self._history_path:
+            self._history_path = os.path.join(self.destination,
+                                              DEFAULT_HISTORY_FILE_PATH)
+            if not os.path.isfile(self._history_path):
+                open(self._history_path, 'a').close()
+        return self._history_path
+
     @property
     def library_path(self):
         """Returns the path to the library file. Generates a blank file if it
@@ -56,6 +106,36 @@ class HibikiConfig(object):
                 open(self._library_path, 'a').close()
         return self._library_path
 
+    @property
+    def rules(self):
+        """Returns a dictionary of the include and exclude rules and the
+        settings that affect the selection of the synced tracks or the way
+        they are written onto the destination.
+        """
+        return {'excludes': self.excludes.serialize(sort=True),
+                'includes': self.includes.serialize(sort=True),
+                'layout': self.layout,
+                'priority': self.priority,
+                'random_fill': self.random_fill,
+                'transfer_mode': self.transfer_mode,
+                'use_subfolders': self.use_subfolders,
+                'validate_sources': self.validate_sources,
+                'max_file_count': self.max_file_count}
+
+    @property
+    def scan_cache_path(self):
+        """Returns the path where the directory scan of a music folder used as
+        the library is cached.
+        """
+        return os.path.join(self.destination, DEFAULT_SCAN_CACHE_FILE_PATH)
+
+    @property
+    def snapshot_path(self):
+        """Returns the path where the library snapshot of the last complete
+        sync is saved.
+        """
+        return os.path.join(self.destination, DEFAULT_SNAPSHOT_FILE_PATH)
+
     @destination.setter
     def destination(self, value):
         """Sets the destination drive. Throws an exception if the destination
@@ -70,7 +150,8 @@ class HibikiConfig(object):
         """Loads the configuration from a MessagePack file. If the optional
         path argument is not given, the default configuration path is used.
         Raises InvalidConfigError if the file cannot be read as a MessagePack
-        file.
+        file, if the priority, the fsync policy or the transfer mode is unknown
+        or if the layout template cannot be parsed.
         """
         if not path:
             path = self.config_path
@@ -84,14 +165,46 @@ class HibikiConfig(object):
                 from .exceptions import InvalidConfigError
                 raise InvalidConfigError(message='Config cannot be read')
             else:
+                self.bandwidth_limit = data.get('bandwidth_limit',
+                                                self.bandwidth_limit)
+                self.fsync = data.get('fsync', self.fsync)
+                self.fsync_interval = data.get('fsync_interval',
+                                               self.fsync_interval)
                 self.itunes_path = data.get('itunes_path',
                                             self.itunes_path)
+                self.layout = data.get('layout', self.layout)
                 self.max_file_count = data.get('max_file_count',
                                                self.max_file_count)
+                self.memory_limit = data.get('memory_limit',
+                                             self.memory_limit)
+                self.parse_workers = data.get('parse_workers',
+                                              self.parse_workers)
+                self.priority = data.get('priority', self.priority)
+                self.profile = data.get('profile', self.profile)
                 self.random_fill = data.get('random_fill',
                                             self.random_fill)
+                self.transfer_mode = data.get('transfer_mode',
+                                              self.transfer_mode)
                 self.use_subfolders = data.get('use_subfolders',
                                                self.use_subfolders)
+                self.validate_sources = data.get('validate_sources',
+                                                 self.validate_sources)
+                if self.priority not in (None,) + tuple(POLICIES):
+                    from .exceptions import InvalidConfigError
+                    raise InvalidConfigError(
+                        message='Unknown priority policy')
+                if self.fsync not in FSYNC_POLICIES:
+                    from .exceptions import InvalidConfigError
+                    raise InvalidConfigError(
+                        message='Unknown fsync policy')
+                if self.transfer_mode not in TRANSFER_MODES:
+                    from .exceptions import InvalidConfigError
+                    raise InvalidConfigError(
+                        message='Unknown transfer mode')
+                if self.layout and not Layout.validate(self.layout):
+                    from .exceptions import InvalidConfigError
+                    raise InvalidConfigError(
+                        message='Layout template cannot be parsed')
 
     def save_config_file(self, path=None):
         """Saves the configuration as a MessagePack file. If the optional path
@@ -102,10 +215,20 @@ class HibikiConfig(object):
         if not os.path.exists(self.config_folder):
             os.mkdir(self.config_folder)
         data = {}
+        data['bandwidth_limit'] = self.bandwidth_limit
+        data['fsync'] = self.fsync
+        data['fsync_interval'] = self.fsync_interval
         data['itunes_path'] = self.itunes_path
+        data['layout'] = self.layout
         data['max_file_count'] = self.max_file_count
+        data['memory_limit'] = self.memory_limit
+        data['parse_workers'] = self.parse_workers
+        data['priority'] = self.priority
+        data['profile'] = self.profile
         data['random_fill'] = self.random_fill
+        data['transfer_mode'] = self.transfer_mode
         data['use_subfolders'] = self.use_subfolders
+        data['validate_sources'] = self.validate_sources
         with open(path, 'w') as file:
             json.dump(data, file, separators=(',', ':'))
 
@@ -151,8 +274,10 @@ class HibikiConfigFilters(object):
 
     def get_playlist_tracks(self):
         """Gets the iTunes track IDs from the playlists defined in
-        self.playlists and saves them in the object.
+        self.playlists and saves them in the object, replacing the ones found
+        earlier.
         """
+        self.tracks = set()
         for playlist in self.config.parent.itunes.playlists:
             if playlist.name in self.playlists:
                 for track in playlist.tracks:
@@ -199,13 +324,14 @@ class HibikiConfigFilters(object):
         with open(path, 'w') as file:
             json.dump(self.serialize(), file, separators=(',', ':'))
 
-    def serialize(self):
+    def serialize(self, sort=False):
         """Converts the attributes into a dictionary which can be in turn saved
-        as a configuration file.
+        as a configuration file. If sort is True, the lists are sorted so that
+        the same rules always serialize the same way.
         """
         output = {}
         for group in ['albums', 'artists', 'genres', 'playlists']:
             items = getattr(self, group)
             if len(items) > 0:
-                output[group] = list(items)
+                output[group] = sorted(items) if sort else list(items)
         return output
@@ -3,6 +3,44 @@ Constant values used with the module.
 """
 
 
+AUDIO_EXTENSIONS = frozenset(('.aac', '.aif', '.aiff', '.alac', '.flac',
+                              '.m4a', '.mp3', '.ogg', '.opus', '.wav',
+                              '.wma'))
+COPY_BLOCK_SIZE = 1024 * 1024
+DELETE_BATCH_SIZE = 100
+DELETE_WORKERS = 4
 DEFAULT_CONFIG_FILE_PATH = '.hibiki/config'
+DEFAULT_FILES_FILE_PATH = '.hibiki/files'
+DEFAULT_FSYNC_INTERVAL = 16
+DEFAULT_FINGERPRINT_FILE_PATH = '.hibiki/fingerprint'
+DEFAULT_HISTORY_FILE_PATH = '.hibiki/history'
 DEFAULT_LIBRARY_FILE_PATH = '.hibiki/library'
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024
+DEFAULT_PROFILES_FOLDER_PATH = '.hibiki/profiles'
+DEFAULT_SCAN_CACHE_FILE_PATH = '.hibiki/scan'
+DEFAULT_SNAPSHOT_FILE_PATH = '.hibiki/snapshot'
+DIRECTORY_ENTRY_SIZE = 32
+EXFAT_MAX_DIRECTORY_ENTRIES = 256 * 1024 * 1024 // 32
+FAT_MAX_DIRECTORY_ENTRIES = 65536
+FICLONE = 0x40049409
+FSYNC_POLICIES = ('none', 'interval', 'file')
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+LIBRARY_HEADER_SIZE = 64 * 1024
+MANIFEST_VERSION = 1
+MOUNTS_PATH = '/proc/mounts'
+PARALLEL_PARSE_THRESHOLD = 32 * 1024 * 1024
+PIPELINE_POLL_INTERVAL = 0.1
+PROFILE_ENVIRONMENT_KEY = 'HIBIKI_PROFILE'
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+RECORD_SIZE = 2048
+SCAN_WORKERS = 4
+SHARDS_PER_WORKER = 4
+SIZE_SAMPLE_COUNT = 16
+SIZE_STAT_LIMIT = 64
+THROUGHPUT_WINDOW = 10
 TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+TRANSFER_MODES = ('copy', 'link')
+VALIDATE_BATCH_SIZE = 256
+VALIDATE_WORKERS = 16
+WATCH_DEBOUNCE_DELAY = 5
+WATCH_POLL_INTERVAL = 10
@@ -2,30 +2,121 @@
 Provides the main Hibiki class used for the music synchronization.
 """
 
+from array import array
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import functools
 import json
 import os
 import os.path
 import random
-import shutil
+import time
+from .backends import LocalBackend
+from .capacity import CapacityModel
 from .config import HibikiConfig
-from .itunes import iTunesLibrary
+from .constants import (DELETE_BATCH_SIZE, DELETE_WORKERS, SIZE_SAMPLE_COUNT,
+                        SIZE_STAT_LIMIT, VALIDATE_BATCH_SIZE,
+                        VALIDATE_WORKERS)
+from .dedup import DuplicateIndex, file_hash
+from .diff import LibrarySnapshot
+from .events import (CopyDoneEvent, CopyStartEvent, DeleteEvent, ErrorEvent,
+                     PlanEvent, RenameEvent)
+from .layout import Layout
+from .metrics import SyncMetrics
+from .pipeline import SyncPipeline
+from .priority import TrackQueue
+from .profiling import profiled
+from .sources import open_library
+from .transfer import CopyPolicy, source_size
 
 
 class Hibiki(object):
-    """Main class used for the music syncing."""
+    """Main class used for the music syncing. The file operations on the
+    destination are performed by the DestinationBackend in backend, which is
+    a LocalBackend by default.
+    """
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, itunes=None, load_library=True,
+                 backend=None):
+        self._copy_policy = None
+        self._copy_settings = None
+        self._destinations = {}
+        self._duplicate_index = DuplicateIndex()
+        self._entries = {}
+        self._filenames = {}
+        self._folder_counts = {}
+        self._layout = None
+        self._materialized = {}
+        self._outdated = set()
+        self._sizes = {}
+        self._source_sizes = {}
         self._subfolder = 0
+        self._synced = {}
+        self.backend = backend or LocalBackend()
+        self.capacity = None
+        self.complete = True
+        self.duplicates = {}
         self.itunes = None
+        self.metrics = SyncMetrics()
         self.tracks = set()
+        self.unavailable = []
 
         if config:
             self.config = config
             self.config.parent = self
-            self.update_itunes()
+            if itunes:
+                self.itunes = itunes
+            elif load_library:
+                self.update_itunes()
         else:
             self.config = HibikiConfig(parent=self)
 
+    @property
+    def copy_policy(self):
+        """Returns the CopyPolicy for the transfer settings of the config. The
+        policy is kept while the settings stay the same, so that the bandwidth
+        limit applies across the copies.
+        """
+        settings = (self.config.bandwidth_limit, self.config.fsync,
+                    self.config.fsync_interval)
+        if self._copy_policy is None or self._copy_settings != settings:
+            self._copy_policy = CopyPolicy.from_configs([self.config])
+            self._copy_settings = settings
+        return self._copy_policy
+
+    @property
+    def files_data(self):
+        """Returns the JSON data written in the files file, which contains the
+        cached sizes of the synced files keyed by their relative paths.
+        """
+        with open(self.config.files_path, 'r') as file:
+            try:
+                return json.load(file)
+            except ValueError:
+                return {}
+
+    @files_data.setter
+    def files_data(self, value):
+        with open(self.config.files_path, 'w') as file:
+            json.dump(value, file, separators=(',', ':'))
+
+    @property
+    def history_data(self):
+        """Returns the JSON data written in the history file, which contains
+        the times the tracks were last copied onto the destination as Unix
+        timestamps keyed by their persistent IDs.
+        """
+        with open(self.config.history_path, 'r') as file:
+            try:
+                return json.load(file)
+            except ValueError:
+                return {}
+
+    @history_data.setter
+    def history_data(self, value):
+        with open(self.config.history_path, 'w') as file:
+            json.dump(value, file, separators=(',', ':'))
+
     @property
     def library_data(self):
         """Returns the JSON data written in the library file."""
@@ -40,165 +131,865 @@ class Hibiki(object):
         with open(self.config.library_path, 'w') as file:
             json.dump(value, file, separators=(',', ':'))
 
+    @property
+    def layout(self):
+        """Returns the Layout for the path template in config.layout."""
+        if self._layout is None or \
+                self._layout.template != self.config.layout or \
+                self._layout.backend is not self.backend:
+            self._layout = Layout(self.config.layout, backend=self.backend)
+        return self._layout
+
     @property
     def target_directory(self):
         """Returns the target directory for file copy operations. If
         config.use_subfolders is set to False, always returns the destination
         folder. Else it returns the first folder that has less than the maximum
         allowed amount of files. The last non-full folder is saved in
-        _subfolder so that full directories don't get checked again.
-        Filenames starting with '.' are ignored.
+        _subfolder so that full directories don't get checked again, and the
+        file counts of the folders are cached in _folder_counts so that each
+        folder is only listed once. Filenames starting with '.' are ignored.
         """
         if self.config.use_subfolders:
             while True:
                 directory = os.path.join(self.config.destination,
                                          str(self._subfolder))
-                if os.path.isdir(directory):
-                    file_count = 0
-                    for file in os.listdir(directory):
-                        if file[0] != '.':
-                            file_count += 1
-                    if file_count < self.config.max_file_count:
+                if directory not in self._folder_counts:
+                    if not self.backend.isdir(directory):
+                        self.layout.make_directory(directory)
+                        self._folder_counts[directory] = 0
                         return directory
-                    else:
-                        self._subfolder += 1
-                else:
-                    os.makedirs(directory)
+                    self._folder_counts[directory] = sum(
+                        1 for x in self.backend.listdir(directory)
+                        if x[0] != '.')
+                if self._folder_counts[directory] < self.config.max_file_count:
                     return directory
+                self._subfolder += 1
         else:
             return self.config.destination
 
+    def _target_path(self, name):
+        """Returns the full path for a file with the relative name from the
+        layout. With a path template, the directories of the path are created.
+        Otherwise the file is placed in the target directory and counted in
+        its file count.
+        """
+        if self.config.layout:
+            path = self.full_library_path(name)
+            self.layout.make_directory(os.path.dirname(path))
+            return path
+        directory = self.target_directory
+        if directory in self._folder_counts:
+            self._folder_counts[directory] += 1
+        return os.path.join(directory, name)
+
     def _copy_file(self, track):
-        """Performs the file copy operation."""
-        destination_path = os.path.join(self.target_directory, track.filename)
-        with open(track.path, 'rb') as fin:
-            with open(destination_path, 'wb') as fout:
-                shutil.copyfileobj(fin, fout)
-        return destination_path
-
-    def _clean_sync_list(self, delete_callback=None, error_callback=None):
+        """Performs the file copy operation. Partially written files are
+        removed if the copy fails. With the 'link' transfer mode, the file is
+        cloned or hard linked instead if possible. Returns the destination
+        path and how the file was materialized: 'reflink', 'hardlink' or
+        'copy'.
+        """
+        destination_path = self._destination_path(track)
+        if self.config.transfer_mode == 'link':
+            mode = self.backend.link_file(track.path, destination_path)
+            if mode:
+                return destination_path, mode
+        errors = self.backend.copy_file(track.path, [destination_path],
+                                        size=track.size,
+                                        policy=self.copy_policy)
+        if errors:
+            raise errors[destination_path]
+        return destination_path, 'copy'
+
+    def _destination_path(self, track):
+        """Returns the full path the track will be copied to, using the path
+        planned for the file by the layout.
+        """
+        owner = self.duplicates.get(track.persistent_id, track.persistent_id)
+        name = self._filenames.get(owner) or self.layout.path(track)
+        return self._target_path(name)
+
+    def _existing_destination(self, track):
+        """Returns the full path of the file on the destination that already
+        has the content of the track, or None if the track needs to be copied.
+        """
+        owner = self.duplicates.get(track.persistent_id, track.persistent_id)
+        if owner in self._destinations:
+            return self.full_library_path(self._destinations[owner])
+        return None
+
+    def _record_copy(self, track, destination, seconds, mode='copy'):
+        """Records the track as copied into the destination path in the given
+        number of seconds, so that tracks with the same content can use the
+        same file. The way the file was materialized is recorded for the files
+        file.
+        """
+        owner = self.duplicates.get(track.persistent_id, track.persistent_id)
+        path = os.path.relpath(destination, self.config.destination)
+        self._destinations[owner] = path
+        self._materialized[path] = {'size': track.size, 'mode': mode}
+        self.metrics.record_copy(track.size, seconds)
+
+    def _add_track(self, track, space):
+        """Adds the track to the sync list if it fits in the available space
+        and returns the space left afterwards. The space used is taken from
+        self.capacity and the directory entry limit of the file system is
+        respected. Tracks with the same content as an already added track are
+        recorded in self.duplicates and added without using up any space.
+        """
+        owner = self._duplicate_index.find(track)
+        name = self.layout.path(track)
+        cost = self.capacity.cost(track.size, os.path.basename(name))
+        if owner is not None:
+            self.duplicates[track.persistent_id] = owner
+            self.tracks.add(track.persistent_id)
+        elif space >= cost and self._add_entries(name):
+            space -= cost
+            self._duplicate_index.add(track)
+            self._filenames[track.persistent_id] = name
+            self._sizes[track.persistent_id] = track.size
+            self.tracks.add(track.persistent_id)
+        else:
+            self.complete = False
+        return space
+
+    def _add_entries(self, name):
+        """Counts the directory entries of the file with the relative name
+        from the layout against the limit of the file system. Returns False
+        without counting them if the limit would be exceeded. Numbered
+        subfolders are not limited, as they are created as they are needed.
+        """
+        limit = self.capacity.max_entries
+        if limit is None:
+            return True
+        if self.config.use_subfolders and not self.config.layout:
+            return True
+        directory, filename = os.path.split(name)
+        entries = self._entries.get(directory, 0) + self.capacity.entries(
+            filename)
+        if entries > limit:
+            return False
+        self._entries[directory] = entries
+        return True
+
+    def _untracked_entries(self):
+        """Returns the number of directory entries used in the destination
+        directory by the files and directories not in the library file.
+        """
+        tracked = set(self.library_data.values())
+        return sum(self.capacity.entries(x)
+                   for x in self.backend.listdir(self.config.destination)
+                   if x not in tracked)
+
+    @profiled('delete')
+    def _clean_sync_list(self, delete_callback=None, error_callback=None,
+                         rename_callback=None):
         """Removes all the tracks not present in the sync list from destination
         and removes tracks from the sync list if already present on the
-        destination.
+        destination. Files shared with tracks that are kept are not removed.
+        Kept files whose path no longer matches the track location or the
+        subfolder layout are renamed in place. Directories left empty are
+        removed and the library file is written once at the end. The time
+        spent is recorded as the 'delete' phase in self.metrics.
         """
+        with self.metrics.measure('delete'):
+            self._clean_destination(delete_callback=delete_callback,
+                                    error_callback=error_callback,
+                                    rename_callback=rename_callback)
+        self.metrics.bytes_total = sum(
+            self._sizes[x] for x in self.tracks
+            if x in self._sizes and x not in self._destinations)
+
+    def _clean_destination(self, delete_callback=None, error_callback=None,
+                           rename_callback=None):
+        """Performs the deletions and renames for _clean_sync_list()."""
         library = self.library_data
+        self._destinations = {}
+        self._folder_counts = {}
+        for track in library:
+            if track in self.tracks and track not in self._outdated:
+                owner = self.duplicates.get(track, track)
+                self._destinations[owner] = library[track]
+        shared = set(self._destinations.values())
+        stale = {}
         for track in library.copy():
-            if track in self.tracks:
+            if track in self.tracks and track not in self._outdated:
                 self.tracks.remove(track)
+            elif library[track] in shared:
+                del library[track]
             else:
-                path = os.path.join(self.config.destination, library[track])
-                try:
-                    os.remove(path)
-                except FileNotFoundError as error:
-                    if error_callback:
-                        error_callback(path, error)
-                    continue
-                if delete_callback:
-                    delete_callback(library[track])
+                stale.setdefault(library[track], []).append(track)
+        deleted = self._delete_files(stale, delete_callback=delete_callback,
+                                     error_callback=error_callback)
+        for path in deleted:
+            for track in stale[path]:
                 del library[track]
+        moved = self._relocate_files(library, rename_callback=rename_callback,
+                                     error_callback=error_callback)
+        self._prune_directories(deleted + moved)
+        self._folder_counts = {}
+        self.layout.forget()
         self.library_data = library
 
+    def _delete_batch(self, paths):
+        """Deletes the files in the given relative paths. Returns a tuple
+        containing a list of the deleted paths and a list of (path, error)
+        tuples for the files that couldn't be deleted.
+        """
+        deleted = []
+        errors = []
+        for path in paths:
+            try:
+                self.backend.remove(self.full_library_path(path))
+            except OSError as error:
+                errors.append((self.full_library_path(path), error))
+            else:
+                deleted.append(path)
+        return deleted, errors
+
+    def _delete_files(self, paths, delete_callback=None, error_callback=None):
+        """Deletes the files in the given relative paths using a small pool of
+        workers, each deleting a batch of files from a single directory.
+        delete_callback is called with the list of deleted paths after each
+        batch and error_callback with the path and the error for every file
+        that couldn't be deleted. Returns a list of the deleted paths.
+        """
+        directories = {}
+        for path in paths:
+            directories.setdefault(os.path.dirname(path), []).append(path)
+        batches = []
+        for files in directories.values():
+            for index in range(0, len(files), DELETE_BATCH_SIZE):
+                batches.append(files[index:index + DELETE_BATCH_SIZE])
+        result = []
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+            futures = [executor.submit(self._delete_batch, x) for x in batches]
+            for future in as_completed(futures):
+                deleted, errors = future.result()
+                result.extend(deleted)
+                if deleted and delete_callback:
+                    delete_callback(deleted)
+                if error_callback:
+                    for path, error in errors:
+                        error_callback(path, error)
+        return result
+
+    def _expected_path(self, filename, current):
+        """Returns the relative path where a file with the given relative
+        name from the layout is expected to be on the destination, based on
+        its current relative path and the subfolder settings. Files already in
+        a numbered subfolder are left in it. With a path template, the
+        directories of the path are created.
+        """
+        if self.config.layout:
+            self.layout.make_directory(
+                os.path.dirname(self.full_library_path(filename)))
+            return filename
+        if not self.config.use_subfolders:
+            return filename
+        directory = os.path.dirname(current)
+        if not directory.isdigit():
+            return os.path.relpath(self._target_path(filename),
+                                   self.config.destination)
+        return os.path.join(directory, filename)
+
+    def _relocate_files(self, library, rename_callback=None,
+                        error_callback=None):
+        """Renames the kept files on the destination whose relative path
+        differs from the expected one and updates the library data
+        accordingly, so that changed locations don't need a new copy. Files
+        are not renamed over existing files. Returns a list of the old paths
+        of the renamed files.
+        """
+        members = {}
+        moved = {}
+        for track in library:
+            members.setdefault(library[track], []).append(track)
+        for owner, current in list(self._destinations.items()):
+            if current in moved:
+                self._destinations[owner] = moved[current]
+                continue
+            if owner not in self._filenames:
+                continue
+            expected = self._expected_path(self._filenames[owner], current)
+            if expected == current:
+                continue
+            path = self.full_library_path(expected)
+            if self.backend.exists(path):
+                continue
+            try:
+                self.backend.rename(self.full_library_path(current), path)
+            except OSError as error:
+                if error_callback:
+                    error_callback(self.full_library_path(current), error)
+                continue
+            for track in members.get(current, []):
+                library[track] = expected
+            self._destinations[owner] = expected
+            moved[current] = expected
+            if rename_callback:
+                rename_callback(current, expected)
+        return list(moved)
+
     def _mark_file(self, track, destination):
-        """Writes the file persistant ID and path into to library file."""
+        """Writes the file persistant ID and path into to library file. The
+        sync time is recorded for the history file.
+        """
         data = self.library_data
         data[track.persistent_id] = os.path.relpath(destination,
                                                     self.config.destination)
         self.library_data = data
+        self._synced[track.persistent_id] = int(time.time())
+
+    def _save_records(self):
+        """Writes the sync times and the materialized files recorded since
+        the last call into the history file and the files file.
+        """
+        if self._synced:
+            history = self.history_data
+            history.update(self._synced)
+            self.history_data = history
+            self._synced = {}
+        if self._materialized:
+            files = self.files_data
+            files.update(self._materialized)
+            self.files_data = files
+            self._materialized = {}
+
+    def _scan_file_sizes(self, paths):
+        """Returns the sizes of the files in the given relative paths that
+        exist on the destination, scanning each directory once instead of
+        checking the size of every file.
+        """
+        directories = {}
+        for path in paths:
+            directory, name = os.path.split(path)
+            directories.setdefault(directory, []).append(name)
+        sizes = {}
+        for directory, names in directories.items():
+            try:
+                files, _ = self.backend.scan_directory(
+                    self.full_library_path(directory))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                if name in files:
+                    sizes[os.path.join(directory, name)] = files[name]
+        return sizes
+
+    def _stat_file_sizes(self, paths):
+        """Returns the sizes of the files in the given relative paths that
+        exist on the destination by checking the size of every file.
+        """
+        sizes = {}
+        for path in paths:
+            try:
+                sizes[path] = self.backend.size(self.full_library_path(path))
+            except FileNotFoundError:
+                pass
+        return sizes
+
+    def _prune_directories(self, paths):
+        """Removes the directories of the given relative paths, and their
+        parent directories, if they have been left empty. The destination
+        directory itself is never removed.
+        """
+        directories = set(os.path.dirname(x) for x in paths)
+        for directory in sorted(directories, key=len, reverse=True):
+            while directory:
+                try:
+                    self.backend.rmdir(self.full_library_path(directory))
+                except OSError:
+                    break
+                directory = os.path.dirname(directory)
 
     def calculate_space(self):
         """Calculates the available space if all the tracks in the library were
-        to be removed.
+        to be removed. Files shared by several tracks are only counted once.
+        The file sizes are taken from the files file and validated by checking
+        a random sample of them. If the sample doesn't match or too many sizes
+        are missing, all the sizes are refreshed by scanning the directories.
+        Tracks whose files no longer exist are removed from the library. The
+        space used by the files is calculated with self.capacity, which is
+        refreshed for the destination. The recorded transfer modes are kept
+        for the files whose size hasn't changed.
         """
+        self.capacity = CapacityModel(self.config.destination,
+                                      backend=self.backend)
         available = self.space_available()
         library = self.library_data
+        cached = self.files_data
+        paths = set(library.values())
+        unknown = [x for x in paths if x not in cached]
+        known = [x for x in paths if x in cached]
+        sample = random.sample(known, min(len(known), SIZE_SAMPLE_COUNT))
+        sizes = self._stat_file_sizes(sample + unknown)
+        valid = all(sizes.get(x) == cached[x]['size'] for x in sample)
+        if valid and len(unknown) <= SIZE_STAT_LIMIT:
+            for path in known:
+                sizes.setdefault(path, cached[path]['size'])
+        else:
+            sizes = self._scan_file_sizes(paths)
         for track in library.copy():
-            path = self.full_library_path(library[track])
-            try:
-                stat = os.stat(path)
-            except FileNotFoundError:
+            if library[track] not in sizes:
                 del library[track]
-            else:
-                available += stat.st_size
         self.library_data = library
-        return available
+        files = {}
+        for path, size in sizes.items():
+            files[path] = {'size': size}
+            if path in cached and cached[path]['size'] == size and \
+                    'mode' in cached[path]:
+                files[path]['mode'] = cached[path]['mode']
+        self.files_data = files
+        return available + sum(self.capacity.cost(y, os.path.basename(x))
+                               for x, y in sizes.items())
+
+    def _sync_track(self, track):
+        """Copies the track onto the destination, unless a file with the same
+        content is already there, and marks it in the library file. Returns
+        the full destination path. Raises OSError if the copy fails.
+        """
+        self._apply_source_size(track)
+        destination = self._existing_destination(track)
+        if destination is None:
+            start = time.monotonic()
+            destination, mode = self._copy_file(track)
+            self._record_copy(track, destination, time.monotonic() - start,
+                              mode=mode)
+        self._mark_file(track, destination)
+        return destination
 
+    @profiled('copy')
     def copy_tracks(self, after_callback=None, before_callback=None,
                     error_callback=None, end_signal=None):
         """Goes through the tracks in the iTunes library and copies the tracks
         onto the destination. before_callback and after_callback are called
         with the track object if they are set before and after the copy process
         respectively. The copying process will last until the track list has
-        been exhausted or the end_signal is True.
+        been exhausted or the end_signal callable returns True. The time spent
+        is recorded as the 'copy' phase in self.metrics.
         """
-        track_iterator = self.itunes.tracks
-        if not end_signal:
-            end_signal = False
-        while not end_signal:
+        with self.metrics.measure('copy'):
             try:
-                track = next(track_iterator)
-            except StopIteration:
+                self._copy_pending(after_callback=after_callback,
+                                   before_callback=before_callback,
+                                   error_callback=error_callback,
+                                   end_signal=end_signal)
+            finally:
+                self._save_records()
+
+    def _copy_pending(self, after_callback=None, before_callback=None,
+                      error_callback=None, end_signal=None):
+        """Performs the copying for copy_tracks()."""
+        for track in self.pending_tracks:
+            if end_signal and end_signal():
                 return
-            if track.persistent_id in self.tracks:
-                if before_callback:
-                    before_callback(track)
-                try:
-                    destination = self._copy_file(track)
-                except OSError as error:
-                    os.remove(destination)
-                    if error_callback:
-                        error_callback(track, error)
-                        continue
-                self._mark_file(track, destination)
-                if after_callback:
-                    after_callback(track)
+            if before_callback:
+                before_callback(track)
+            try:
+                self._sync_track(track)
+            except OSError as error:
+                if error_callback:
+                    error_callback(track, error)
+                continue
+            if after_callback:
+                after_callback(track)
 
     def full_library_path(self, track):
         """Returns the full path for the relative library paths."""
         return os.path.join(self.config.destination, track)
 
-    def generate_sync_list(self, delete_callback=None, error_callback=None):
-        """Generates a set of the items to be synced using the iTunes
-        persistent IDs and the available space on the target destination if all
-        the current tracks were to be deleted. Adds random items to the sync
-        list if config.random_fill returns True.
+    @profiled('plan')
+    def _plan_sync_list(self, diff=None):
+        """Generates the set of the tracks to be synced in self.tracks and
+        returns the space left on the destination after the selection. If a
+        LibraryDiff is given and random fill is not used, only the changed
+        tracks are evaluated against the sync rules. If files of the tracks
+        kept on the destination turn out to be missing, they are forgotten and
+        the selection is made again from scratch, so that the tracks are
+        copied again and the space of the files is not counted twice. The time
+        spent is recorded as the 'plan' phase in self.metrics.
         """
+        with self.metrics.measure('plan'):
+            if diff is not None and not self.config.random_fill:
+                space = self._select_changed_tracks(diff)
+            else:
+                space = self._select_tracks()
+            if self._forget_missing_files():
+                space = self._select_tracks()
+            self._filenames = Layout.resolve(self._filenames)
+            return space
+
+    def _forget_missing_files(self):
+        """Checks that the files of the selected tracks that are already on
+        the destination still exist, scanning their directories. Files that
+        are missing, for example because they were deleted by hand, are
+        removed from the library file and the files file. Returns True if any
+        were missing.
+        """
+        library = self.library_data
+        paths = {library[x] for x in library
+                 if x in self.tracks and x not in self._outdated}
+        missing = paths - set(self._scan_file_sizes(paths))
+        if not missing:
+            return False
+        self.library_data = {x: y for x, y in library.items()
+                             if y not in missing}
+        self.files_data = {x: y for x, y in self.files_data.items()
+                           if x not in missing}
+        return True
+
+    def _reset_selection(self, playlists=True):
+        """Clears the sync list and returns the available space for it. The
+        tracks of the playlist rules are looked up unless playlists is False.
+        """
+        self._duplicate_index = DuplicateIndex()
+        self._entries = {}
+        self._filenames = {}
+        self._outdated = set()
+        self._sizes = {}
+        self._source_sizes = {}
+        self.complete = True
+        self.duplicates = {}
+        self.tracks = set()
+        self.unavailable = []
         space = self.calculate_space()
-        self.config.excludes.get_playlist_tracks()
-        self.config.includes.get_playlist_tracks()
+        if self.capacity.max_entries is not None:
+            self._entries[''] = self._untracked_entries()
+        if playlists:
+            self.config.excludes.get_playlist_tracks()
+            self.config.includes.get_playlist_tracks()
+        return space
+
+    def _select_changed_tracks(self, diff):
+        """Performs an incremental track selection for _plan_sync_list(). The
+        tracks already on the destination are kept without evaluating the sync
+        rules again, except for the changed tracks in the diff, which are
+        evaluated like in a full selection. Modified tracks and the tracks
+        sharing their content are marked as outdated so that their files are
+        deleted and copied again. Tracks whose files were found missing while
+        calculating the space are evaluated again as well.
+        """
+        synced = set(self.library_data)
+        space = self._reset_selection()
+        library = self.library_data
+        changed = diff.changed | (synced - set(library))
+        kept = [x for x in library
+                if x not in changed and x not in diff.removed]
+        for track in self.itunes.tracks_by_persistent_ids(kept):
+            space = self._add_track(track, space)
+        included = [x for x in self.itunes.tracks_by_persistent_ids(changed)
+                    if not self.config.excludes.is_filtered(x) and
+                    self.config.includes.is_filtered(x)]
+        for track in self._available_tracks(included):
+            space = self._add_track(track, space)
+        if self.config.priority and not self.complete:
+            return self._select_tracks()
+        owners = {self.duplicates.get(x, x) for x in diff.modified}
+        self._outdated = {x for x in self.tracks
+                          if self.duplicates.get(x, x) in owners}
+        return space
+
+    def _select_tracks(self):
+        """Performs the track selection for _plan_sync_list()."""
+        space = self._reset_selection()
 
+        included = []
         for track in self.itunes.tracks:
             if self.config.excludes.is_filtered(track):
                 continue
             if self.config.includes.is_filtered(track):
-                if space >= track.size:
-                    space -= track.size
-                    self.tracks.add(track.persistent_id)
+                included.append(track)
+        synced = self.library_data if self.config.validate_sources else ()
+        included = self._available_tracks(included, synced=synced)
+        if self.config.priority:
+            space = self._add_by_priority(included, space)
+        else:
+            for track in included:
+                space = self._add_track(track, space)
 
         if self.config.random_fill:
             random.seed()
-            music = list(self.itunes.tracks)
-            while len(music) > 0:
-                track = random.sample(music, 1)[0]
-                if not self.config.excludes.is_filtered(track):
-                    if track.persistent_id not in self.tracks:
-                        if space >= track.size:
-                            space -= track.size
-                            self.tracks.add(track.persistent_id)
-                music.remove(track)
+            order = array('L', range(self.itunes.track_count))
+            random.shuffle(order)
+            for index in range(0, len(order), VALIDATE_BATCH_SIZE):
+                batch = [self.itunes.track_at(x)
+                         for x in order[index:index + VALIDATE_BATCH_SIZE]]
+                batch = [x for x in batch
+                         if not self.config.excludes.is_filtered(x) and
+                         x.persistent_id not in self.tracks]
+                for track in self._available_tracks(batch, synced=synced,
+                                                    limit=space):
+                    space = self._add_track(track, space)
+        return space
+
+    @staticmethod
+    def _check_source(track):
+        """Returns a (size, error) tuple for the source file of the track,
+        where error is the OSError raised while checking it or None.
+        """
+        try:
+            return source_size(track.path), None
+        except OSError as error:
+            return None, error
+
+    def _available_tracks(self, tracks, synced=(), limit=None):
+        """Returns the list of the given tracks whose source files are
+        available if config.validate_sources is set, and the tracks unchanged
+        otherwise. The source files are checked in parallel by a pool of
+        threads, except for the tracks with persistent IDs in synced, which
+        are already on the destination, and the tracks larger than limit
+        bytes, which can't be added anyway. Every source file is checked once
+        per plan. The sizes of the checked tracks are corrected to the real
+        sizes of their files. The tracks whose files are missing or cannot be
+        read are left out and recorded in self.unavailable as (track, error)
+        tuples.
+        """
+        if not self.config.validate_sources:
+            return tracks
+        checked = [x for x in tracks if x.persistent_id not in synced and
+                   x.persistent_id not in self._source_sizes and
+                   (limit is None or x.size <= limit)]
+        with ThreadPoolExecutor(max_workers=VALIDATE_WORKERS) as executor:
+            results = executor.map(self._check_source, checked)
+            for track, (size, error) in zip(checked, results):
+                self._source_sizes[track.persistent_id] = size
+                if error is not None:
+                    self.unavailable.append((track, error))
+        available = []
+        for track in tracks:
+            if track.persistent_id in self._source_sizes:
+                if self._source_sizes[track.persistent_id] is None:
+                    continue
+                self._apply_source_size(track)
+            available.append(track)
+        return available
 
+    def _apply_source_size(self, track):
+        """Sets the size of the track to the size of its source file if the
+        file was checked while planning.
+        """
+        size = self._source_sizes.get(track.persistent_id)
+        if size is not None:
+            track.size = size
+
+    def _add_by_priority(self, tracks, space):
+        """Adds the tracks to the sync list in the order of the priority
+        policy in config.priority and returns the space left afterwards. Once
+        the space left is smaller than any of the tracks, the remaining tracks
+        are only added if they share their content with an added track.
+        """
+        history = None
+        if self.config.priority == 'least_recently_synced':
+            history = self.history_data
+        queue = TrackQueue(tracks, self.config.priority, history=history)
+        while queue and space >= queue.smallest:
+            space = self._add_track(queue.pop(), space)
+        for track in queue.remaining():
+            space = self._add_track(track, space)
+        return space
+
+    def generate_sync_list(self, delete_callback=None, error_callback=None,
+                           rename_callback=None, diff=None):
+        """Generates a set of the items to be synced using the iTunes
+        persistent IDs and the available space on the target destination if all
+        the current tracks were to be deleted. Adds random items to the sync
+        list if config.random_fill returns True. Tracks with duplicate content
+        are only counted once against the available space. If the included
+        tracks don't all fit, config.priority names the policy for choosing the
+        synced ones, and the tracks first in the library are chosen otherwise.
+        If a LibraryDiff from the library state of the previous sync is given,
+        only the changed tracks are evaluated against the sync rules. With
+        config.validate_sources, error_callback is called with the track and
+        the error for every track left out because its source file is not
+        available.
+        """
+        self._plan_sync_list(diff=diff)
+        if error_callback:
+            for track, error in self.unavailable:
+                error_callback(track, error)
         self._clean_sync_list(delete_callback=delete_callback,
-                              error_callback=error_callback)
+                              error_callback=error_callback,
+                              rename_callback=rename_callback)
+
+    @property
+    def pending_tracks(self):
+        """Generator that returns the iTunesTrack objects for the tracks in the
+        sync list that still need to be copied.
+        """
+        for track in self.itunes.tracks:
+            if track.persistent_id in self.tracks:
+                yield track
+
+    def rebuild_library(self, verify=False):
+        """Rebuilds the library file by scanning the destination for files that
+        match the tracks in the iTunes library by filename and size, so files
+        already on the destination are reused instead of copied again. Both
+        the source filename and the filename from the layout are matched. If
+        verify is True, the file contents are also compared by hash. The
+        recorded transfer modes are kept for the files whose size hasn't
+        changed. Returns the number of matched tracks.
+        """
+        found = {}
+        scanned = self.backend.scan_tree(self.config.destination)
+        for path, size in scanned.items():
+            key = (os.path.basename(path), size)
+            found.setdefault(key, []).append(path)
+        hashes = {}
+        used = set()
+        library = {}
+        for track in self.itunes.tracks:
+            names = {track.filename,
+                     os.path.basename(self.layout.path(track))}
+            candidates = [x for name in sorted(names)
+                          for x in found.get((name, track.size), [])]
+            if verify and candidates:
+                try:
+                    digest = file_hash(track.path)
+                except OSError:
+                    continue
+                for path in candidates:
+                    if path not in hashes:
+                        hashes[path] = self.backend.file_hash(
+                            self.full_library_path(path))
+                candidates = [x for x in candidates if hashes[x] == digest]
+            if not candidates:
+                continue
+            unused = [x for x in candidates if x not in used]
+            path = unused[0] if unused else candidates[0]
+            library[track.persistent_id] = path
+            used.add(path)
+        self.library_data = library
+        cached = self.files_data
+        files = {}
+        for path in used:
+            files[path] = {'size': scanned[path]}
+            if path in cached and cached[path].get('size') == scanned[path] \
+                    and 'mode' in cached[path]:
+                files[path]['mode'] = cached[path]['mode']
+        self.files_data = files
+        return len(library)
+
+    def load_snapshot(self):
+        """Returns the LibrarySnapshot saved on the destination by the last
+        complete sync. Returns None if there is no snapshot or if it was saved
+        with different sync rules.
+        """
+        snapshot = LibrarySnapshot.load(self.config.snapshot_path)
+        if snapshot is None or snapshot.rules != self.config.rules:
+            return None
+        return snapshot
+
+    def save_snapshot(self, snapshot):
+        """Saves the LibrarySnapshot of the synced library state together with
+        the current sync rules onto the destination.
+        """
+        snapshot.rules = self.config.rules
+        snapshot.save(self.config.snapshot_path)
 
     def space_available(self, reserve=5):
         """Returns the number of available bytes on the target destination.
         Reserves 5 MB of free space by default on the drive just in case.
         """
-        drive_stats = os.statvfs(self.config.destination)
+        drive_stats = self.backend.statvfs(self.config.destination)
         space = drive_stats.f_bavail * drive_stats.f_frsize
         return space - (reserve * 1024 * 1024)
 
+    async def sync(self, executor=None, diff=None):
+        """Asynchronous generator that performs the whole sync and yields
+        SyncEvent objects describing its progress: a PlanEvent after the sync
+        list has been generated, DeleteEvent and RenameEvent objects while the
+        destination is cleaned, CopyStartEvent and CopyDoneEvent objects for
+        every copied track and ErrorEvent objects for failures, including the
+        tracks left out by config.validate_sources after the PlanEvent. All
+        file operations are ran in the given executor, or the default executor
+        of the event loop. Tracks are copied one at a time and only when the
+        consumer asks for the next event, and closing the generator or
+        cancelling the consuming task stops the sync after the current file.
+        If a LibraryDiff is given, the sync list is updated incrementally.
+        """
+        loop = asyncio.get_running_loop()
+        space = await loop.run_in_executor(
+            executor, functools.partial(self._plan_sync_list, diff=diff))
+        yield PlanEvent(set(self.tracks), space)
+        for track, error in self.unavailable:
+            yield ErrorEvent(track, error)
+
+        queue = asyncio.Queue()
+
+        def put(event):
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+        clean = functools.partial(
+            self._clean_sync_list,
+            delete_callback=lambda paths: put(DeleteEvent(paths)),
+            error_callback=lambda path, error: put(ErrorEvent(path, error)),
+            rename_callback=lambda old, new: put(RenameEvent(old, new)))
+        future = loop.run_in_executor(executor, clean)
+        future.add_done_callback(lambda _: queue.put_nowait(None))
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+        await future
+
+        tracks = self.pending_tracks
+        self.metrics.start('copy')
+        try:
+            while True:
+                track = await loop.run_in_executor(executor, next, tracks,
+                                                   None)
+                if track is None:
+                    return
+                yield CopyStartEvent(track)
+                try:
+                    destination = await loop.run_in_executor(
+                        executor, self._sync_track, track)
+                except OSError as error:
+                    yield ErrorEvent(track, error)
+                else:
+                    yield CopyDoneEvent(track, destination)
+        finally:
+            self.metrics.stop()
+            self._save_records()
+
+    async def stream_sync(self, executor=None, memory_limit=None):
+        """Asynchronous generator that performs the whole sync with a
+        SyncPipeline and yields the same SyncEvent objects as sync(), except
+        for RenameEvent objects. The library is parsed while the tracks are
+        copied, so the iTunes library doesn't need to be loaded, and the
+        memory used for it stays within memory_limit bytes, or
+        config.memory_limit megabytes by default. Raises HibikiException if
+        the sync rules cannot be streamed.
+        """
+        if not SyncPipeline.supported(self.config):
+            from .exceptions import HibikiException
+            raise HibikiException(
+                message='Sync rules cannot be streamed')
+        if memory_limit is None and self.config.memory_limit:
+            memory_limit = self.config.memory_limit * 1024 * 1024
+        loop = asyncio.get_running_loop()
+        events = SyncPipeline(self, memory_limit=memory_limit).events()
+        try:
+            while True:
+                event = await loop.run_in_executor(executor, next, events,
+                                                   None)
+                if event is None:
+                    return
+                yield event
+        finally:
+            events.close()
+
+    @profiled('parse')
     def update_itunes(self):
-        """Sets the self.itunes instance to a new iTunesLibrary object found in
-        the path defined by the self.config object.
+        """Sets the self.itunes instance to a new LibrarySource for the path
+        defined by the self.config object: an iTunesLibrary for an iTunes
+        Library.xml file or a DirectorySource for a music folder. The time
+        spent is recorded as the 'parse' phase in self.metrics.
         """
-        self.itunes = iTunesLibrary(self.config.itunes_path)
+        with self.metrics.measure('parse'):
+            self.itunes = open_library(self.config.itunes_path,
+                                       workers=self.config.parse_workers,
+                                       cache_path=self.config.scan_cache_path)
@@ -0,0 +1,65 @@
+"""
+Provides duplicate content detection for the tracks selected for syncing.
+"""
+
+import hashlib
+
+
+def file_hash(path, block_size=1024 * 1024):
+    """Returns the SHA-1 hex digest of the contents of the file in path."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DuplicateIndex(object):
+    """Keeps track of the content of the tracks added to the sync list so that
+    tracks referencing the same file, or identical files in different
+    locations, only need to be copied once. Tracks are compared by source path
+    first, then by size and finally by content hash, which is only calculated
+    for files whose sizes match.
+    """
+
+    def __init__(self):
+        self._hashes = {}
+        self._paths = {}
+        self._sizes = {}
+
+    def _hash(self, path):
+        """Returns the cached content hash for the path. Returns None if the
+        file cannot be read.
+        """
+        if path not in self._hashes:
+            try:
+                self._hashes[path] = file_hash(path)
+            except OSError:
+                self._hashes[path] = None
+        return self._hashes[path]
+
+    def add(self, track):
+        """Registers the track as the owner of its content."""
+        self._paths.setdefault(track.path, track.persistent_id)
+        self._sizes.setdefault(track.size, []).append(track.path)
+
+    def find(self, track):
+        """Returns the persistent ID of a previously added track with the same
+        content as the given track. Returns None if there is no such track.
+        """
+        owner = self._paths.get(track.path)
+        if owner is not None:
+            return owner
+        candidates = self._sizes.get(track.size)
+        if not candidates:
+            return None
+        digest = self._hash(track.path)
+        if digest is None:
+            return None
+        for path in candidates:
+            if self._hash(path) == digest:
+                return self._paths[path]
+        return None
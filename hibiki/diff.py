@@ -0,0 +1,126 @@
+"""
+Provides compact library snapshots and a diff engine for comparing them, used
+for re-evaluating the sync rules only for the tracks that changed.
+"""
+
+import json
+from .constants import TIME_FORMAT
+
+TRACK_FIELDS = ('size', 'location', 'artist', 'album', 'genre')
+
+
+class LibrarySnapshot(object):
+    """Compact state of a library. Stores a (date modified, size, location,
+    artist, album, genre) tuple for the persistent ID of every track and a
+    frozenset of the track persistent IDs for the name of every playlist. rules
+    can hold the sync rules the snapshot was synced with.
+    """
+
+    def __init__(self, tracks=None, playlists=None, rules=None):
+        self.tracks = tracks or {}
+        self.playlists = playlists or {}
+        self.rules = rules
+
+    @classmethod
+    def from_library(cls, library):
+        """Creates a snapshot of an iTunesLibrary object."""
+        tracks = {}
+        identifiers = {}
+        for track in library.tracks:
+            modified = getattr(track, 'date_modified', None)
+            if modified:
+                modified = modified.strftime(TIME_FORMAT)
+            tracks[track.persistent_id] = tuple(
+                [modified] + [getattr(track, x, None) for x in TRACK_FIELDS])
+            identifiers[track.track_id] = track.persistent_id
+        playlists = {}
+        for playlist in library.playlists:
+            items = frozenset(identifiers[x] for x in playlist.tracks
+                              if x in identifiers)
+            playlists[playlist.name] = playlists.get(playlist.name,
+                                                     frozenset()) | items
+        return cls(tracks, playlists)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a snapshot saved with save(). Returns None if the file doesn't
+        exist or cannot be read.
+        """
+        try:
+            with open(path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        tracks = {x: tuple(y) for x, y in data.get('tracks', {}).items()}
+        playlists = {x: frozenset(y)
+                     for x, y in data.get('playlists', {}).items()}
+        return cls(tracks, playlists, data.get('rules'))
+
+    def diff(self, other):
+        """Returns a LibraryDiff of the changes from this snapshot to the other
+        snapshot.
+        """
+        return LibraryDiff(self, other)
+
+    def save(self, path):
+        """Saves the snapshot as JSON data."""
+        data = {'tracks': self.tracks,
+                'playlists': {x: list(y) for x, y in self.playlists.items()},
+                'rules': self.rules}
+        with open(path, 'w') as file:
+            json.dump(data, file, separators=(',', ':'))
+
+
+class LibraryDiff(object):
+    # pylint: disable=too-few-public-methods
+    """Changes between two library snapshots. Tracks are compared by their
+    persistent IDs: added and removed contain the tracks only present in the
+    new or the old snapshot, modified the tracks whose date modified or size
+    changed, moved the tracks whose location changed otherwise and updated the
+    tracks whose artist, album or genre changed otherwise. playlists maps the
+    names of the playlists whose membership changed to the set of track
+    persistent IDs added to or removed from them.
+    """
+
+    def __init__(self, old, new):
+        self.added = set()
+        self.modified = set()
+        self.moved = set()
+        self.playlists = {}
+        self.removed = set()
+        self.updated = set()
+
+        for track, record in new.tracks.items():
+            previous = old.tracks.get(track)
+            if previous is None:
+                self.added.add(track)
+            elif previous[:2] != record[:2]:
+                self.modified.add(track)
+            elif previous[2] != record[2]:
+                self.moved.add(track)
+            elif previous != record:
+                self.updated.add(track)
+        for track in old.tracks:
+            if track not in new.tracks:
+                self.removed.add(track)
+        for name in set(old.playlists) | set(new.playlists):
+            before = old.playlists.get(name, frozenset())
+            after = new.playlists.get(name, frozenset())
+            if before != after:
+                self.playlists[name] = before ^ after
+
+    @property
+    def changed(self):
+        """Returns the set of the persistent IDs of the tracks in the new
+        snapshot whose sync rules need to be evaluated again.
+        """
+        tracks = self.added | self.modified | self.moved | self.updated
+        for items in self.playlists.values():
+            tracks |= items
+        return tracks - self.removed
+
+    @property
+    def empty(self):
+        """Returns True if nothing changed between the snapshots."""
+        return not (self.added or self.modified or self.moved or
+                    self.playlists or self.removed or self.updated)
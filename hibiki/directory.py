@@ -0,0 +1,131 @@
+"""
+Provides a library source that scans a music folder directly, for syncing
+without an iTunes Library.xml file.
+"""
+
+from datetime import datetime, timezone
+import hashlib
+import json
+import os.path
+import re
+from .constants import AUDIO_EXTENSIONS, SCAN_WORKERS
+from .scan import scan_music_tree
+from .sources import LibrarySource
+
+TRACK_NUMBER_PATTERN = re.compile(r'^(\d{1,3})[ ._-]+')
+
+
+class DirectoryTrack(object):
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """Track found by scanning a music folder. Only the path, the size and the
+    modification time of the file are read, so the name, the track number,
+    the album and the artist are taken from the path, laid out as
+    'Artist/Album/01 Name.mp3'. The persistent ID is derived from the path.
+    """
+
+    def __init__(self, location, size, mtime, track_id, library=None):
+        self.library = library
+        self.location = location
+        self.size = size
+        self.track_id = track_id
+
+        parts = location.split(os.sep)
+        name = os.path.splitext(parts[-1])[0]
+        match = TRACK_NUMBER_PATTERN.match(name)
+        self.album = parts[-2] if len(parts) > 1 else None
+        self.album_artist = None
+        self.artist = parts[-3] if len(parts) > 2 else None
+        self.composer = None
+        self.date_added = None
+        self.date_modified = datetime.fromtimestamp(
+            mtime / 1e9, timezone.utc).replace(tzinfo=None)
+        self.disc_count = 0
+        self.disc_number = 0
+        self.genre = None
+        self.name = name[match.end():] if match else name
+        self.persistent_id = hashlib.sha1(
+            location.encode('utf-8')).hexdigest()[:16].upper()
+        self.play_count = 0
+        self.rating = 0
+        self.track_count = 0
+        self.track_number = int(match.group(1)) if match else 0
+        self.year = None
+
+    @property
+    def filename(self):
+        """Returns just the filename from the location information."""
+        return os.path.basename(self.location)
+
+    @property
+    def path(self):
+        """Returns the path to the track."""
+        return os.path.join(self.library.music_folder, self.location)
+
+
+class DirectorySource(LibrarySource):
+    """Library of the audio files found in a directory tree, in the order of
+    their relative paths. The directories are scanned in parallel and the
+    results are cached in cache_path, so that later scans only list the
+    directories whose modification time has changed. Files changed in place
+    keep their cached size until their directory changes or the cache is
+    removed. Has no playlists.
+    """
+
+    def __init__(self, path, cache_path=None, max_workers=SCAN_WORKERS):
+        super().__init__()
+        self.cache_path = cache_path
+        self.music_folder = os.path.abspath(path)
+        self.path = path
+
+        files, cache = scan_music_tree(self.music_folder, AUDIO_EXTENSIONS,
+                                       cache=self._load_cache(),
+                                       max_workers=max_workers)
+        self._save_cache(cache)
+        self._entries = sorted((x, y[0], y[1]) for x, y in files.items())
+
+    @property
+    def track_count(self):
+        """Returns the number of tracks in the library."""
+        return len(self._entries)
+
+    @property
+    def tracks(self):
+        """Generator that returns DirectoryTrack objects for each and every
+        track in the library.
+        """
+        for position in range(len(self._entries)):
+            yield self.track_at(position)
+
+    def track_at(self, position):
+        """Returns the track in the given position in the library."""
+        location, size, mtime = self._entries[position]
+        return DirectoryTrack(location, size, mtime, position + 1,
+                              library=self)
+
+    def _load_cache(self):
+        """Returns the cached directory entries if the cache was made for the
+        same music folder, and None otherwise.
+        """
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if data.get('root') != self.music_folder:
+            return None
+        return data.get('directories')
+
+    def _save_cache(self, cache):
+        """Writes the directory entries into the cache file, if set. The
+        cache is optional, so failing to write it is ignored.
+        """
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, 'w') as file:
+                json.dump({'root': self.music_folder, 'directories': cache},
+                          file, separators=(',', ':'))
+        except OSError:
+            pass
@@ -0,0 +1,71 @@
+"""
+Provides the event classes yielded by the asynchronous Hibiki.sync() method.
+"""
+
+
+class SyncEvent(object):
+    # pylint: disable=too-few-public-methods
+    """Base class for all the sync events."""
+
+
+class PlanEvent(SyncEvent):
+    # pylint: disable=too-few-public-methods
+    """Yielded after the sync list has been generated. Contains the set of
+    persistent IDs of the tracks selected for the destination and the number
+    of bytes of available space left after the selection.
+    """
+
+    def __init__(self, tracks, space):
+        self.tracks = tracks
+        self.space = space
+
+
+class DeleteEvent(SyncEvent):
+    # pylint: disable=too-few-public-methods
+    """Yielded after a batch of files has been deleted from the destination.
+    Contains the list of deleted relative paths.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+
+
+class RenameEvent(SyncEvent):
+    # pylint: disable=too-few-public-methods
+    """Yielded after a file has been renamed on the destination. Contains the
+    old and the new relative path.
+    """
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+
+
+class CopyStartEvent(SyncEvent):
+    # pylint: disable=too-few-public-methods
+    """Yielded before a track is copied. Contains the iTunesTrack object."""
+
+    def __init__(self, track):
+        self.track = track
+
+
+class CopyDoneEvent(SyncEvent):
+    # pylint: disable=too-few-public-methods
+    """Yielded after a track has been copied. Contains the iTunesTrack object
+    and the full destination path.
+    """
+
+    def __init__(self, track, destination):
+        self.track = track
+        self.destination = destination
+
+
+class ErrorEvent(SyncEvent):
+    # pylint: disable=too-few-public-methods
+    """Yielded when an error occurs. Contains the iTunesTrack object or the
+    path that caused the error and the exception itself.
+    """
+
+    def __init__(self, data, error):
+        self.data = data
+        self.error = error
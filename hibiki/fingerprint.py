@@ -0,0 +1,89 @@
+"""
+Provides fingerprints of the sync inputs, used for finishing runs where
+nothing has changed since the last complete sync without loading the library.
+"""
+
+import json
+import os
+import re
+from .constants import LIBRARY_HEADER_SIZE, MANIFEST_VERSION
+
+PERSISTENT_ID_PATTERN = re.compile(
+    rb'<key>Library Persistent ID</key>\s*<string>([^<]*)</string>')
+
+
+def file_identity(path):
+    """Returns a [size, modification time] list for the file, or None if it
+    doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def library_persistent_id(path):
+    """Returns the library persistent ID from the header of an iTunes
+    Library.xml file without parsing the whole file, or None if it isn't
+    found.
+    """
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(LIBRARY_HEADER_SIZE)
+    except OSError:
+        return None
+    match = PERSISTENT_ID_PATTERN.search(header)
+    return match.group(1).decode('utf-8') if match else None
+
+
+def compute(config):
+    """Returns the fingerprint of the HibikiConfig as a dictionary: the size,
+    modification time and persistent ID of the library file, the sync rules,
+    the library path, the size and modification time of the library file on
+    the destination and the manifest version.
+    """
+    return {'itunes': file_identity(config.itunes_path),
+            'itunes_path': config.itunes_path,
+            'library_id': library_persistent_id(config.itunes_path),
+            'manifest': file_identity(config.library_path),
+            'manifest_version': MANIFEST_VERSION,
+            'rules': config.rules}
+
+
+def load(config):
+    """Returns the fingerprint saved on the destination, or None if there is
+    none or it cannot be read.
+    """
+    try:
+        with open(config.fingerprint_path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def matches(config):
+    """Returns True if the fingerprint saved by the last complete sync matches
+    the current one, meaning that a sync would not change anything. Always
+    returns False with random fill, which changes the synced tracks on every
+    sync, and for music folders used as the library, whose changes don't show
+    in the fingerprint.
+    """
+    if config.random_fill or os.path.isdir(config.itunes_path):
+        return False
+    saved = load(config)
+    return saved is not None and saved == compute(config)
+
+
+def save(config):
+    """Saves the current fingerprint onto the destination."""
+    with open(config.fingerprint_path, 'w') as file:
+        json.dump(compute(config), file, separators=(',', ':'))
+
+
+def remove(config):
+    """Removes the saved fingerprint, if any."""
+    try:
+        os.remove(config.fingerprint_path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,294 @@
+"""
+Non-interactive command-line interface for scripted syncs. Progress is written
+to standard output as line-delimited JSON. Run with `python -m hibiki`.
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import signal
+import sys
+import time
+from .core import Hibiki
+from .config import HibikiConfig
+from .constants import (FSYNC_POLICIES, WATCH_DEBOUNCE_DELAY,
+                        WATCH_POLL_INTERVAL)
+from .diff import LibrarySnapshot
+from . import fingerprint
+from .events import (CopyDoneEvent, CopyStartEvent, DeleteEvent, ErrorEvent,
+                     PlanEvent, RenameEvent)
+from .exceptions import HibikiException
+from .pipeline import SyncPipeline
+from .priority import POLICIES
+from .watch import LibraryWatcher
+
+EXIT_SUCCESS = 0
+EXIT_ERRORS = 1
+EXIT_INVALID = 2
+
+
+def emit(data, stream=sys.stdout):
+    """Writes the dictionary as a single JSON line and flushes the stream."""
+    stream.write(json.dumps(data, separators=(',', ':')) + '\n')
+    stream.flush()
+
+
+def track_data(track):
+    """Returns a dictionary describing the track."""
+    return {'persistent_id': track.persistent_id, 'name': track.name,
+            'artist': track.artist, 'size': track.size}
+
+
+def event_data(event):
+    """Returns a JSON serializable dictionary describing the sync event."""
+    if isinstance(event, PlanEvent):
+        return {'event': 'plan', 'tracks': len(event.tracks),
+                'space': event.space}
+    if isinstance(event, DeleteEvent):
+        return {'event': 'delete', 'paths': event.paths}
+    if isinstance(event, RenameEvent):
+        return {'event': 'rename', 'old': event.old, 'new': event.new}
+    if isinstance(event, CopyStartEvent):
+        return {'event': 'copy_start', 'track': track_data(event.track)}
+    if isinstance(event, CopyDoneEvent):
+        return {'event': 'copy_done', 'track': track_data(event.track),
+                'destination': event.destination}
+    if isinstance(event, ErrorEvent):
+        data = {'event': 'error', 'error': str(event.error)}
+        if isinstance(event.data, str):
+            data['path'] = event.data
+        else:
+            data['track'] = track_data(event.data)
+        return data
+    return {'event': type(event).__name__}
+
+
+def load_config(args):
+    """Returns a HibikiConfig for the destination with the configuration file,
+    the filter files and the command-line overrides applied.
+    """
+    config = HibikiConfig(args.destination)
+    os.makedirs(config.config_folder, exist_ok=True)
+    if args.config or config.config_exists:
+        config.load_config_file(args.config)
+    for filters in (config.includes, config.excludes):
+        try:
+            filters.load_from_file()
+        except FileNotFoundError:
+            pass
+    if args.itunes_path:
+        config.itunes_path = args.itunes_path
+    if args.random_fill is not None:
+        config.random_fill = args.random_fill
+    if args.priority:
+        config.priority = args.priority
+    if args.memory_limit:
+        config.memory_limit = args.memory_limit
+    if args.bandwidth_limit:
+        config.bandwidth_limit = args.bandwidth_limit
+    if args.fsync:
+        config.fsync = args.fsync
+    if args.fsync_interval:
+        config.fsync_interval = args.fsync_interval
+    if args.validate_sources:
+        config.validate_sources = True
+    if not config.itunes_path:
+        raise HibikiException('iTunes Library.xml path not set')
+    return config
+
+
+async def run(hibiki, args, previous=None):
+    """Runs the sync, emitting every event, and returns the summary counts and
+    the LibrarySnapshot of the synced library. If the LibrarySnapshot of the
+    previous sync is given, only the tracks changed since then are evaluated
+    against the sync rules. The snapshot and the fingerprint are saved onto the
+    destination if the sync completed without errors. If the library hasn't
+    been loaded, the sync is streamed with a SyncPipeline and no snapshot is
+    taken. The library file is rebuilt from the destination first only if
+    asked for with --rebuild.
+    """
+    counts = {'copied': 0, 'deleted': 0, 'renamed': 0, 'errors': 0}
+    if args.rebuild:
+        if hibiki.itunes is None:
+            hibiki.update_itunes()
+        emit({'event': 'rebuild',
+              'tracks': hibiki.rebuild_library(verify=args.verify)})
+        previous = None
+    snapshot = None
+    if hibiki.itunes is None:
+        events = hibiki.stream_sync()
+    else:
+        snapshot = LibrarySnapshot.from_library(hibiki.itunes)
+        diff = None
+        if previous is not None and not args.full:
+            diff = previous.diff(snapshot)
+            emit({'event': 'diff', 'added': len(diff.added),
+                  'modified': len(diff.modified), 'moved': len(diff.moved),
+                  'removed': len(diff.removed), 'updated': len(diff.updated),
+                  'playlists': sorted(diff.playlists)})
+        events = hibiki.sync(diff=diff)
+    async for event in events:
+        if isinstance(event, CopyDoneEvent):
+            counts['copied'] += 1
+        elif isinstance(event, DeleteEvent):
+            counts['deleted'] += len(event.paths)
+        elif isinstance(event, RenameEvent):
+            counts['renamed'] += 1
+        elif isinstance(event, ErrorEvent):
+            counts['errors'] += 1
+        if args.verbose or not isinstance(event, CopyStartEvent):
+            emit(event_data(event))
+    if counts['errors'] or not hibiki.complete:
+        fingerprint.remove(hibiki.config)
+        return counts, None
+    if snapshot is not None:
+        hibiki.save_snapshot(snapshot)
+    fingerprint.save(hibiki.config)
+    return counts, snapshot
+
+
+def summary_data(hibiki, counts, start):
+    """Returns the summary of a sync as a dictionary and the exit status."""
+    status = EXIT_ERRORS if counts['errors'] else EXIT_SUCCESS
+    summary = {'event': 'summary', 'status': status,
+               'seconds': time.monotonic() - start,
+               'bytes': hibiki.metrics.bytes_copied,
+               'phases': hibiki.metrics.phases}
+    summary.update(counts)
+    return summary, status
+
+
+async def watch(hibiki, args):
+    """Keeps the Hibiki object and its parsed library in memory and runs a
+    sync every time the iTunes Library.xml file changes, until cancelled. When
+    streaming, the library is parsed again for every sync instead. A sync that
+    fails is reported with an error event and the watching continues. The
+    watcher waits in a thread of its own, so that it can be closed once the
+    thread has returned.
+    """
+    loop = asyncio.get_running_loop()
+    waiter = ThreadPoolExecutor(max_workers=1)
+    watcher = LibraryWatcher(hibiki.config.itunes_path,
+                             debounce=args.debounce, interval=args.interval)
+    emit({'event': 'watch', 'path': watcher.path,
+          'inotify': watcher.uses_inotify})
+    streaming = hibiki.itunes is None
+    previous = None if streaming else hibiki.load_snapshot()
+    try:
+        while await loop.run_in_executor(waiter, watcher.wait):
+            start = time.monotonic()
+            hibiki.metrics.reset()
+            emit({'event': 'change', 'path': watcher.path})
+            try:
+                if not streaming:
+                    await loop.run_in_executor(None, hibiki.update_itunes)
+                counts, snapshot = await run(hibiki, args, previous)
+            except Exception as error:  # pylint: disable=broad-except
+                emit({'event': 'error', 'error': str(error)})
+                continue
+            previous = snapshot
+            emit(summary_data(hibiki, counts, start)[0])
+    finally:
+        watcher.stop()
+        waiter.shutdown(wait=True)
+        watcher.close()
+
+
+def main(argv=None):
+    """Parses the arguments, runs the sync and returns the exit status: 0 on
+    success, 1 if any errors occurred during the sync and 2 if the
+    destination or the configuration is invalid.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m hibiki',
+        description='Syncs iTunes tracks to a destination without a UI.')
+    parser.add_argument('destination', help='path to the destination')
+    parser.add_argument('--config', help='path to the configuration file, '
+                        'defaults to .hibiki/config in the destination')
+    parser.add_argument('--itunes-path', help='path to iTunes Library.xml')
+    parser.add_argument('--random-fill', action='store_true', default=None,
+                        help='fill the remaining space with random tracks')
+    parser.add_argument('--no-random-fill', action='store_false',
+                        dest='random_fill', help='disable random fill')
+    parser.add_argument('--priority', choices=sorted(POLICIES),
+                        help='policy for choosing the synced tracks when the '
+                        'included tracks don\'t all fit')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild the library file before syncing')
+    parser.add_argument('--verify', action='store_true',
+                        help='compare file hashes when rebuilding')
+    parser.add_argument('--full', action='store_true',
+                        help='sync even if nothing has changed and evaluate '
+                        'the sync rules for every track instead of only the '
+                        'tracks changed since the last sync')
+    parser.add_argument('--stream', action='store_true',
+                        help='parse the library while copying, keeping the '
+                        'memory used for it bounded, if the sync rules '
+                        'don\'t use playlists, random fill or a priority')
+    parser.add_argument('--memory-limit', type=int, metavar='MB',
+                        help='memory ceiling for the library when streaming')
+    parser.add_argument('--bandwidth-limit', type=float, metavar='MB',
+                        help='maximum copy speed in megabytes per second')
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES,
+                        help='when copied files are flushed onto the disk')
+    parser.add_argument('--fsync-interval', type=int, metavar='MB',
+                        help='megabytes written between flushes with '
+                        '--fsync interval')
+    parser.add_argument('--validate-sources', action='store_true',
+                        help='check that the source files of the planned '
+                        'tracks exist and use their real sizes')
+    parser.add_argument('--verbose', action='store_true',
+                        help='also emit an event before every copy')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and sync again whenever the '
+                        'iTunes Library.xml file changes')
+    parser.add_argument('--debounce', type=float,
+                        default=WATCH_DEBOUNCE_DELAY,
+                        help='seconds to wait for the file to settle')
+    parser.add_argument('--interval', type=float,
+                        default=WATCH_POLL_INTERVAL,
+                        help='polling interval when inotify is unavailable')
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    try:
+        config = load_config(args)
+        unchanged = (not args.full and not args.rebuild and
+                     fingerprint.matches(config))
+        streaming = args.stream and SyncPipeline.supported(config)
+        if args.stream and not streaming:
+            emit({'event': 'stream', 'supported': False})
+        hibiki = None
+        if not unchanged or args.watch:
+            hibiki = Hibiki(config, load_library=not streaming)
+    except (HibikiException, OSError) as error:
+        emit({'event': 'summary', 'status': EXIT_INVALID,
+              'error': str(error)})
+        return EXIT_INVALID
+    if unchanged:
+        status = EXIT_SUCCESS
+        emit({'event': 'unchanged'})
+        emit({'event': 'summary', 'status': status,
+              'seconds': time.monotonic() - start, 'bytes': 0, 'copied': 0,
+              'deleted': 0, 'renamed': 0, 'errors': 0})
+    else:
+        try:
+            counts, _ = asyncio.run(run(hibiki, args,
+                                        hibiki.load_snapshot()))
+        except HibikiException as error:
+            emit({'event': 'summary', 'status': EXIT_INVALID,
+                  'error': str(error)})
+            return EXIT_INVALID
+        summary, status = summary_data(hibiki, counts, start)
+        emit(summary)
+    if args.watch:
+        # The library file has been rebuilt by the first sync if asked for.
+        args.rebuild = False
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            asyncio.run(watch(hibiki, args))
+        except KeyboardInterrupt:
+            pass
+    return status
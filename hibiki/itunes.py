@@ -8,7 +8,9 @@ from datetime import datetime
 from os.path import basename, join
 from urllib.parse import unquote
 from xml.etree import ElementTree
-from .constants import TIME_FORMAT
+from .constants import PARALLEL_PARSE_THRESHOLD, TIME_FORMAT
+from .shards import default_workers, parse_library
+from .sources import LibrarySource
 
 
 def clean_path(path):
@@ -18,15 +20,24 @@ def clean_path(path):
     return unquote(path.replace('file://localhost', ''))
 
 
-class iTunesLibrary(object):
+class iTunesLibrary(LibrarySource):
     """Class the represents a single iTunes Library specified by one iTunes
-    Library.xml file.
+    Library.xml file. The tracks are decoded by the given number of worker
+    processes, by default one for every CPU for files larger than
+    PARALLEL_PARSE_THRESHOLD, and the rest of the file is parsed serially.
     """
 
-    def __init__(self, path):
+    def __init__(self, path, workers=None):
+        super().__init__()
         self.path = path
 
-        tree = ElementTree.parse(path).getroot()[0]
+        if workers is None:
+            workers = default_workers(path, PARALLEL_PARSE_THRESHOLD)
+        parsed = parse_library(path, workers) if workers > 1 else None
+        if parsed:
+            tree, tracks = parsed
+        else:
+            tree = ElementTree.parse(path).getroot()[0]
         for key, value in zip(tree[::2], tree[1::2]):
             if key.text == 'Date':
                 self.date = datetime.strptime(value.text, TIME_FORMAT)
@@ -40,38 +51,8 @@ class iTunesLibrary(object):
                 self._tracks = value
             elif key.text == 'Playlists':
                 self._playlists = value
-
-    @property
-    def all_albums(self):
-        """Returns an alphabetical list of strings containing all available
-        albums in iTunes Library.
-        """
-        return self._get_all_track_info('album')
-
-    @property
-    def all_artists(self):
-        """Returns an alphabetical list of strings containing all available
-        artists in iTunes Library.
-        """
-        return self._get_all_track_info('artist')
-
-    @property
-    def all_genres(self):
-        """Returns an alphabetical list of strings containing all available
-        genres in iTunes Library.
-        """
-        return self._get_all_track_info('genre')
-
-    @property
-    def all_playlists(self):
-        """Returns an alphabetical list of strings containing all available
-        playlists in iTunes Library. Contains default iTunes playlists like
-        "Music" and "Library".
-        """
-        playlists = set()
-        for playlist in self.playlists:
-            playlists.add(playlist.name)
-        return sorted(list(playlists), key=lambda x: x.lower())
+        if parsed:
+            self._tracks = tracks
 
     @property
     def playlists(self):
@@ -89,21 +70,46 @@ class iTunesLibrary(object):
         for data in self._tracks[1::2]:
             yield iTunesTrack(data, library=self)
 
+    @property
+    def index(self):
+        """Returns a dictionary of (position, data) tuples for the persistent
+        IDs of all the tracks in the library. The dictionary is built on first
+        access.
+        """
+        if self._index is None:
+            self._index = {}
+            for position, data in enumerate(self._tracks[1::2]):
+                for key, value in zip(data[::2], data[1::2]):
+                    if key.text == 'Persistent ID':
+                        self._index[value.text] = (position, data)
+                        break
+        return self._index
+
+    @property
+    def track_count(self):
+        """Returns the number of tracks in the library."""
+        return len(self._tracks) // 2
+
+    def track_at(self, position):
+        """Returns the track in the given position in the library."""
+        return iTunesTrack(self._tracks[2 * position + 1], library=self)
+
     def track_by_persistent_id(self, persistent_id):
         """Returns track for persistent ID. If track is not found, None is returned.
         """
-        for track in self.tracks:
-            if track.persistent_id == persistent_id:
-                return track
-        return None
+        try:
+            return iTunesTrack(self.index[persistent_id][1], library=self)
+        except KeyError:
+            return None
 
-    def _get_all_track_info(self, name):
-        items = set()
-        for track in self.tracks:
-            item = getattr(track, name)
-            if item:
-                items.add(item)
-        return sorted(list(items), key=lambda x: x.lower())
+    def tracks_by_persistent_ids(self, persistent_ids):
+        """Generator that returns iTunesTrack objects for the given persistent
+        IDs in the order they appear in the library. Unknown IDs are skipped.
+        """
+        index = self.index
+        found = sorted(index[x] for x in persistent_ids if x in index)
+        for _, data in found:
+            yield iTunesTrack(data, library=self)
 
 
 class iTunesPlaylist(object):
@@ -0,0 +1,127 @@
+"""
+Provides the layout engine that decides the paths of the synced files on the
+destination.
+"""
+
+import os
+import os.path
+import re
+import string
+from .backends import LocalBackend
+
+RESERVED_NAMES = {'CON', 'PRN', 'AUX', 'NUL'} | \
+    {'COM{}'.format(x) for x in range(1, 10)} | \
+    {'LPT{}'.format(x) for x in range(1, 10)}
+UNSAFE_CHARACTERS = re.compile(r'[\x00-\x1f\x7f<>:"/\\|?*]')
+
+
+def sanitize(name, max_length=255):
+    """Returns the name with the characters that are not allowed in file names
+    on FAT, NTFS or HFS+ replaced with underscores. Leading dots, trailing dots
+    and spaces and reserved device names are also replaced, so that the name
+    is safe on all of the file systems.
+    """
+    name = UNSAFE_CHARACTERS.sub('_', name).strip(' ')
+    name = re.sub(r'^\.', '_', name)
+    name = re.sub(r'[. ]+$', '', name)
+    if name.split('.')[0].upper() in RESERVED_NAMES:
+        name = '_' + name
+    return name[:max_length] or '_'
+
+
+class TrackFormatter(string.Formatter):
+    """Formatter that takes the fields from the attributes of an iTunesTrack.
+    Missing values are formatted as 'Unknown' and album_artist falls back to
+    the artist. Characters that are not allowed in file names, including '/',
+    are replaced with underscores in the formatted values, so that only the
+    separators in the template itself start new directories.
+    """
+
+    def get_value(self, key, args, kwargs):
+        track = args[0]
+        value = getattr(track, key, None)
+        if key == 'album_artist' and not value:
+            value = track.artist
+        return value
+
+    def format_field(self, value, format_spec):
+        if value is None or value == '':
+            return 'Unknown'
+        return UNSAFE_CHARACTERS.sub('_',
+                                     super().format_field(value, format_spec))
+
+
+class Layout(object):
+    """Maps tracks to relative paths on the destination. With a template such
+    as '{album_artist}/{album}/{track_number:02} {name}', every directory
+    and the file name are formatted from the track attributes and sanitized,
+    and the extension of the source file is appended. Without a template, the
+    file name of the source file is used. Directories created through the
+    layout are cached so that they are only created once. They are created
+    with the DestinationBackend in backend, a LocalBackend by default.
+    """
+
+    def __init__(self, template=None, backend=None):
+        self.backend = backend or LocalBackend()
+        self.formatter = TrackFormatter()
+        self.template = template
+
+        self._directories = set()
+
+    @staticmethod
+    def validate(template):
+        """Returns True if the template can be parsed."""
+        try:
+            list(string.Formatter().parse(template))
+        except ValueError:
+            return False
+        return True
+
+    def forget(self):
+        """Clears the cache of the created directories."""
+        self._directories.clear()
+
+    def make_directory(self, path):
+        """Creates the directory and its parents unless they have already been
+        created through the layout.
+        """
+        if path in self._directories:
+            return
+        self.backend.makedirs(path)
+        while path and path not in self._directories:
+            self._directories.add(path)
+            path = os.path.dirname(path)
+
+    def path(self, track):
+        """Returns the relative path of the track, without collision handling.
+        The file name of the source file is used if the template cannot be
+        formatted for the track.
+        """
+        if not self.template:
+            return track.filename
+        try:
+            parts = self.formatter.format(self.template, track).split('/')
+        except (IndexError, KeyError, TypeError, ValueError):
+            return track.filename
+        extension = os.path.splitext(track.filename)[1]
+        parts[-1] = sanitize(parts[-1], 255 - len(extension)) + extension
+        return os.path.join(*[sanitize(x) for x in parts[:-1]] + parts[-1:])
+
+    @staticmethod
+    def resolve(paths):
+        """Returns a copy of the dictionary of relative paths keyed by the
+        persistent IDs where the paths that collide, ignoring case, are made
+        unique. The path of the smallest persistent ID is kept and the others
+        get the end of their persistent ID appended to the file name, so that
+        the result doesn't depend on the order of the tracks.
+        """
+        groups = {}
+        for track, path in paths.items():
+            groups.setdefault(path.casefold(), []).append(track)
+        resolved = dict(paths)
+        for tracks in groups.values():
+            for track in sorted(tracks)[1:]:
+                root, extension = os.path.splitext(paths[track])
+                resolved[track] = '{} [{}]{}'.format(root, track[-8:],
+                                                     extension)
+        return resolved
@@ -0,0 +1,117 @@
+"""
+Provides a class for collecting timing and throughput metrics during syncs.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import bisect
+import threading
+import time
+from .constants import LATENCY_BUCKETS, THROUGHPUT_WINDOW
+
+
+class SyncMetrics(object):
+    """Collects the wall time spent in each sync phase, the copy throughput
+    over a moving window, a histogram of the per-file copy latencies and the
+    estimated time remaining based on the bytes left to copy.
+    """
+
+    def __init__(self, window=THROUGHPUT_WINDOW):
+        self._lock = threading.Lock()
+        self.window = window
+        self._clear()
+
+    @property
+    def eta(self):
+        """Returns the estimated number of seconds needed to copy the remaining
+        bytes at the current throughput. Returns None if the throughput is not
+        known yet.
+        """
+        throughput = self.throughput
+        if not throughput:
+            return None
+        return max(0, self.bytes_total - self.bytes_copied) / throughput
+
+    @property
+    def histogram(self):
+        """Returns a list of (upper bound, count) tuples of the per-file copy
+        latencies in seconds. The last bucket has None as its upper bound.
+        """
+        bounds = list(LATENCY_BUCKETS) + [None]
+        return list(zip(bounds, self.latencies))
+
+    @property
+    def throughput(self):
+        """Returns the number of bytes copied per second over the moving
+        window. Returns None if nothing has been copied within the window.
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            if not self._samples:
+                return None
+            start = self._samples[0][0] - self._samples[0][2]
+            elapsed = time.monotonic() - start
+            total = sum(x[1] for x in self._samples)
+        if elapsed <= 0:
+            return None
+        return total / elapsed
+
+    def _expire(self, now):
+        """Removes the samples that have fallen out of the moving window."""
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+
+    @contextmanager
+    def measure(self, phase):
+        """Context manager that adds the wall time spent inside it to the given
+        phase.
+        """
+        self.start(phase)
+        try:
+            yield self
+        finally:
+            self.stop()
+
+    def record_copy(self, size, seconds):
+        """Records a copied file with its size in bytes and the number of
+        seconds the copy took.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._samples.append((now, size, seconds))
+            self._expire(now)
+            self.bytes_copied += size
+            self.files_copied += 1
+            index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+            self.latencies[index] += 1
+
+    def _clear(self):
+        """Sets all the collected metrics to their initial states."""
+        self._samples = deque()
+        self._started = None
+        self.bytes_copied = 0
+        self.bytes_total = 0
+        self.files_copied = 0
+        self.latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.phase = None
+        self.phases = {}
+
+    def reset(self):
+        """Resets all the collected metrics."""
+        with self._lock:
+            self._clear()
+
+    def start(self, phase):
+        """Starts timing the given phase, stopping any phase still running."""
+        self.stop()
+        self.phase = phase
+        self._started = time.monotonic()
+
+    def stop(self):
+        """Stops timing the current phase and adds the elapsed time to it."""
+        if self.phase is None:
+            return
+        elapsed = time.monotonic() - self._started
+        self.phases[self.phase] = self.phases.get(self.phase, 0) + elapsed
+        self.phase = None
+        self._started = None
@@ -0,0 +1,187 @@
+"""
+Provides a class for syncing one library to several destinations at once.
+"""
+
+import time
+from .backends import LocalBackend
+from .core import Hibiki
+from .exceptions import HibikiException
+from .sources import open_library
+from .transfer import CopyPolicy
+
+
+class HibikiGroup(object):
+    # pylint: disable=protected-access
+    """Syncs several destinations, each with its own HibikiConfig, from the
+    same libraries. Each library file is parsed only once and every source file
+    is read once and written to all the destinations that need it. A failure on
+    one destination doesn't affect the others. The callbacks receive the Hibiki
+    object of the destination as their first argument. The destinations share
+    the DestinationBackend in backend, a LocalBackend by default; a source file
+    is read once for every backend of the destinations that need it.
+    """
+
+    def __init__(self, configs, backend=None):
+        self._copy_policy = None
+        self.failed = {}
+        self.members = []
+
+        backend = backend or LocalBackend()
+        libraries = {}
+        for config in configs:
+            if config.itunes_path not in libraries:
+                libraries[config.itunes_path] = open_library(
+                    config.itunes_path, workers=config.parse_workers,
+                    cache_path=config.scan_cache_path)
+            self.members.append(Hibiki(config,
+                                       itunes=libraries[config.itunes_path],
+                                       backend=backend))
+
+    @property
+    def active(self):
+        """Returns a list of the Hibiki objects that haven't failed."""
+        return [x for x in self.members if x not in self.failed]
+
+    @property
+    def copy_policy(self):
+        """Returns the CopyPolicy used for the shared copies, which is the
+        strictest one satisfying the transfer settings of every destination.
+        It is created on first access.
+        """
+        if self._copy_policy is None:
+            self._copy_policy = CopyPolicy.from_configs(
+                [x.config for x in self.members])
+        return self._copy_policy
+
+    def _copy_track(self, track, members, after_callback=None,
+                    before_callback=None, error_callback=None):
+        """Copies the track to all of the given destinations, reading the
+        source file once for the destinations that don't have the content yet.
+        Destinations with the 'link' transfer mode get a clone or a hard link
+        instead if possible. A destination that fails outside the copy itself
+        is marked as failed without affecting the others.
+        """
+        targets = {}
+        for hibiki in members:
+            hibiki._apply_source_size(track)
+            if before_callback:
+                before_callback(hibiki, track)
+            try:
+                destination = hibiki._existing_destination(track)
+                if destination is None:
+                    destination = hibiki._destination_path(track)
+                    mode = None
+                    if hibiki.config.transfer_mode == 'link':
+                        mode = hibiki.backend.link_file(track.path,
+                                                        destination)
+                    if not mode:
+                        targets[destination] = hibiki
+                        continue
+                    hibiki._record_copy(track, destination, 0, mode=mode)
+                hibiki._mark_file(track, destination)
+            except OSError as error:
+                self._fail(hibiki, track, error, error_callback)
+                continue
+            if after_callback:
+                after_callback(hibiki, track)
+        backends = {}
+        for destination, hibiki in targets.items():
+            backends.setdefault(id(hibiki.backend), []).append(destination)
+        for destinations in backends.values():
+            self._write_track(track, {x: targets[x] for x in destinations},
+                              after_callback=after_callback,
+                              error_callback=error_callback)
+
+    def _write_track(self, track, targets, after_callback=None,
+                     error_callback=None):
+        """Copies the track into the destination paths of the dictionary of
+        paths and Hibiki objects, which share the same backend.
+        """
+        backend = next(iter(targets.values())).backend
+        start = time.monotonic()
+        try:
+            errors = backend.copy_file(track.path, list(targets),
+                                       size=track.size,
+                                       policy=self.copy_policy)
+        except OSError as error:
+            errors = {x: error for x in targets}
+        elapsed = time.monotonic() - start
+        for destination, hibiki in targets.items():
+            if destination in errors:
+                if error_callback:
+                    error_callback(hibiki, track, errors[destination])
+                continue
+            hibiki._record_copy(track, destination, elapsed)
+            try:
+                hibiki._mark_file(track, destination)
+            except OSError as error:
+                self._fail(hibiki, track, error, error_callback)
+                continue
+            if after_callback:
+                after_callback(hibiki, track)
+
+    def _fail(self, hibiki, track, error, error_callback=None):
+        """Records the error of the destination in self.failed, so that it is
+        skipped from then on, and calls error_callback with the Hibiki object,
+        the track and the error.
+        """
+        self.failed[hibiki] = error
+        if error_callback:
+            error_callback(hibiki, track, error)
+
+    def copy_tracks(self, after_callback=None, before_callback=None,
+                    error_callback=None, end_signal=None):
+        """Goes through the tracks of each library once and copies every track
+        onto all the destinations that have it in their sync list.
+        before_callback and after_callback are called with the Hibiki object
+        and the track object before and after the copy process respectively.
+        The copying process will last until the track lists have been
+        exhausted or the end_signal callable returns True. Destinations that
+        fail are stored in self.failed and skipped for the rest of the copy.
+        """
+        libraries = {}
+        for hibiki in self.active:
+            libraries.setdefault(id(hibiki.itunes), []).append(hibiki)
+        for members in libraries.values():
+            for hibiki in members:
+                hibiki.metrics.start('copy')
+            try:
+                for track in members[0].itunes.tracks:
+                    if end_signal and end_signal():
+                        return
+                    targets = [x for x in members
+                               if track.persistent_id in x.tracks and
+                               x not in self.failed]
+                    if targets:
+                        self._copy_track(track, targets,
+                                         after_callback=after_callback,
+                                         before_callback=before_callback,
+                                         error_callback=error_callback)
+            finally:
+                for hibiki in members:
+                    hibiki.metrics.stop()
+                    try:
+                        hibiki._save_records()
+                    except OSError as error:
+                        self._fail(hibiki, None, error, error_callback)
+
+    def generate_sync_lists(self, delete_callback=None, error_callback=None,
+                            rename_callback=None):
+        """Generates the sync list for every destination independently. If the
+        planning fails for a destination, the exception is stored in
+        self.failed, error_callback is called with the Hibiki object, None and
+        the exception and the destination is skipped from then on.
+        """
+        def bind(callback, hibiki):
+            if not callback:
+                return None
+            return lambda *args: callback(hibiki, *args)
+
+        for hibiki in self.active:
+            try:
+                hibiki.generate_sync_list(
+                    delete_callback=bind(delete_callback, hibiki),
+                    error_callback=bind(error_callback, hibiki),
+                    rename_callback=bind(rename_callback, hibiki))
+            except (HibikiException, OSError) as error:
+                self._fail(hibiki, None, error, error_callback)
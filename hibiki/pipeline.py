@@ -0,0 +1,276 @@
+"""
+Provides the streaming sync pipeline, which parses, plans and copies at the
+same time with a bounded amount of memory for the library.
+"""
+
+from collections import Counter
+import os.path
+import queue
+import threading
+from .constants import (DEFAULT_MEMORY_LIMIT, DELETE_BATCH_SIZE,
+                        PIPELINE_POLL_INTERVAL, RECORD_SIZE)
+from .events import (CopyDoneEvent, CopyStartEvent, DeleteEvent, ErrorEvent,
+                     PlanEvent)
+from .stream import RecordBuffer, iter_records
+
+END = object()
+
+
+class SyncPipeline(object):
+    # pylint: disable=protected-access
+    """Runs a sync of a Hibiki object as a pipeline of stages connected by
+    bounded queues. A planning thread parses the library incrementally into
+    compact TrackRecord objects, filters them and plans them one at a time,
+    while the consuming stage deletes the files of the tracks that are no
+    longer synced in batches and copies the new tracks as soon as they fit
+    onto the destination. Tracks that don't fit until the deletions are done
+    are held in a RecordBuffer that spills onto disk. The records in the
+    queue and the buffer are kept within memory_limit bytes, so memory use
+    grows with the number of synced tracks but not with the library size.
+
+    Only syncs with include and exclude rules that don't depend on playlists,
+    without random fill and without a priority policy can be streamed, since
+    the others need the whole library before any track can be chosen. Kept
+    files are not relocated and colliding layout paths are resolved in library
+    order; a full sync does both.
+    """
+
+    def __init__(self, hibiki, memory_limit=None):
+        self.hibiki = hibiki
+        self.memory_limit = memory_limit or DEFAULT_MEMORY_LIMIT
+
+        self._deleted = {}
+
+    @property
+    def buffer_size(self):
+        """Returns the number of records the RecordBuffer keeps in memory."""
+        return max(1, self.memory_limit // RECORD_SIZE // 2)
+
+    @property
+    def queue_size(self):
+        """Returns the maximum number of actions waiting in the queue between
+        the planning and the consuming stage.
+        """
+        return max(1, self.memory_limit // RECORD_SIZE // 2)
+
+    @staticmethod
+    def supported(config):
+        """Returns True if syncs with the HibikiConfig can be streamed. Music
+        folders used as the library cannot be.
+        """
+        return not (config.includes.playlists or config.excludes.playlists or
+                    config.random_fill or config.priority or
+                    os.path.isdir(config.itunes_path))
+
+    def events(self):
+        """Generator that performs the whole sync and yields SyncEvent objects
+        describing its progress. The PlanEvent is yielded once the library has
+        been parsed, after any copies that could be started before that.
+        Closing the generator stops the sync after the current file.
+        """
+        hibiki = self.hibiki
+        space = hibiki._reset_selection(playlists=False)
+        hibiki._destinations = {}
+        hibiki._folder_counts = {}
+        self._deleted = {}
+        actions = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        planner = threading.Thread(target=self._plan, daemon=True,
+                                   args=(hibiki.library_data, space, actions,
+                                         stop))
+        buffer = RecordBuffer(self.buffer_size)
+        deletes = {}
+        forgotten = []
+        hibiki.metrics.start('stream')
+        planner.start()
+        try:
+            while True:
+                action = actions.get()
+                if action is END:
+                    break
+                kind, data = action
+                if kind == 'error':
+                    raise data
+                if kind == 'plan':
+                    yield PlanEvent(set(hibiki.tracks), data)
+                elif kind == 'delete':
+                    deletes[data[0]] = data[1]
+                elif kind == 'forget':
+                    forgotten.append(data)
+                elif buffer or not self._fits(data):
+                    yield from self._flush(deletes, forgotten)
+                    if buffer or not self._fits(data):
+                        buffer.append(data)
+                    else:
+                        yield from self._copy(data)
+                else:
+                    yield from self._copy(data)
+                if len(deletes) + len(forgotten) >= DELETE_BATCH_SIZE:
+                    yield from self._flush(deletes, forgotten)
+            yield from self._flush(deletes, forgotten)
+            for record in buffer.drain():
+                yield from self._copy(record)
+            hibiki._prune_directories(list(self._deleted.values()))
+            hibiki._folder_counts = {}
+            hibiki.layout.forget()
+        finally:
+            stop.set()
+            while planner.is_alive():
+                try:
+                    actions.get(timeout=PIPELINE_POLL_INTERVAL)
+                except queue.Empty:
+                    pass
+            buffer.close()
+            hibiki.metrics.stop()
+            hibiki._save_records()
+
+    def _copy(self, record):
+        """Generator that copies the track and yields the copy events."""
+        yield CopyStartEvent(record)
+        try:
+            destination = self.hibiki._sync_track(record)
+        except OSError as error:
+            yield ErrorEvent(record, error)
+        else:
+            yield CopyDoneEvent(record, destination)
+
+    def _fits(self, record):
+        """Returns True if the track can be copied with the space currently
+        available on the destination.
+        """
+        hibiki = self.hibiki
+        if hibiki._existing_destination(record) is not None:
+            return True
+        owner = hibiki.duplicates.get(record.persistent_id,
+                                      record.persistent_id)
+        name = hibiki._filenames.get(owner) or hibiki.layout.path(record)
+        cost = hibiki.capacity.cost(record.size, os.path.basename(name))
+        return hibiki.space_available() >= cost
+
+    def _flush(self, deletes, forgotten):
+        """Generator that deletes the pending files, removes the deleted and
+        forgotten tracks from the library file and yields the delete and error
+        events. Both of the given collections are emptied.
+        """
+        if not deletes and not forgotten:
+            return
+        hibiki = self.hibiki
+        events = []
+        deleted = hibiki._delete_files(
+            list(deletes),
+            delete_callback=lambda paths: events.append(DeleteEvent(paths)),
+            error_callback=lambda path, error: events.append(
+                ErrorEvent(path, error)))
+        library = hibiki.library_data
+        for path in deleted:
+            self._deleted.setdefault(os.path.dirname(path), path)
+            for track in deletes[path]:
+                library.pop(track, None)
+        for track in forgotten:
+            library.pop(track, None)
+        hibiki.library_data = library
+        deletes.clear()
+        del forgotten[:]
+        yield from events
+
+    @staticmethod
+    def _put(actions, stop, action):
+        """Puts the action into the queue, waiting for room unless the
+        pipeline is stopped. Returns False if it was stopped.
+        """
+        while not stop.is_set():
+            try:
+                actions.put(action, timeout=PIPELINE_POLL_INTERVAL)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def _plan(self, library, space, actions, stop):
+        """Runs the planning stage in its own thread, ending with END. Errors
+        are passed on to the consuming stage.
+        """
+        try:
+            self._plan_tracks(library, space, actions, stop)
+        except Exception as error:  # pylint: disable=broad-except
+            self._put(actions, stop, ('error', error))
+        finally:
+            self._put(actions, stop, END)
+
+    def _plan_tracks(self, library, space, actions, stop):
+        """Plans the tracks one at a time in library order and puts the
+        actions for them into the queue. A file listed in the library file is
+        deleted once every track using it has been dropped, and the tracks
+        that are no longer synced are forgotten.
+        """
+        hibiki = self.hibiki
+        config = hibiki.config
+        remaining = Counter(library.values())
+        released = {}
+        pinned = set()
+        kept = set()
+        unseen = dict(library)
+        used = {self._name_key(x) for x in library.values()}
+
+        def release(track, path):
+            remaining[path] -= 1
+            if path in pinned:
+                return self._put(actions, stop, ('forget', track))
+            released.setdefault(path, []).append(track)
+            if remaining[path] > 0:
+                return True
+            return self._put(actions, stop,
+                             ('delete', (path, released.pop(path))))
+
+        for record in iter_records(config.itunes_path):
+            if stop.is_set():
+                return
+            track = record.persistent_id
+            current = unseen.pop(track, None)
+            if not config.excludes.is_filtered(record) and \
+                    config.includes.is_filtered(record):
+                space = hibiki._add_track(record, space)
+            if track not in hibiki.tracks:
+                if current is not None and not release(track, current):
+                    return
+                continue
+            owner = hibiki.duplicates.get(track, track)
+            if track in hibiki._filenames:
+                hibiki._filenames[track] = self._unique_name(
+                    track, hibiki._filenames[track], used)
+            if current is not None and (owner == track or owner in kept):
+                kept.add(owner)
+                hibiki._destinations.setdefault(owner, current)
+                remaining[current] -= 1
+                if current not in pinned:
+                    pinned.add(current)
+                    for other in released.pop(current, []):
+                        if not self._put(actions, stop, ('forget', other)):
+                            return
+                continue
+            if current is not None and not release(track, current):
+                return
+            if owner == track:
+                hibiki.metrics.bytes_total += record.size
+            if not self._put(actions, stop, ('copy', record)):
+                return
+        for track, path in unseen.items():
+            if not release(track, path):
+                return
+        self._put(actions, stop, ('plan', space))
+
+    def _name_key(self, path):
+        """Returns the key used for detecting colliding paths."""
+        if not self.hibiki.config.layout:
+            path = os.path.basename(path)
+        return path.casefold()
+
+    def _unique_name(self, track, name, used):
+        """Returns the relative name for the track, with the end of its
+        persistent ID appended if the name is already used.
+        """
+        if self._name_key(name) in used:
+            root, extension = os.path.splitext(name)
+            name = '{} [{}]{}'.format(root, track[-8:], extension)
+        used.add(self._name_key(name))
+        return name
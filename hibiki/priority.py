@@ -0,0 +1,91 @@
+"""
+Provides the priority policies used for choosing which of the included tracks
+are synced when they don't all fit onto the destination.
+"""
+
+import calendar
+import heapq
+
+
+def most_played(track, _history):
+    """Returns the play count of the track."""
+    return track.play_count or 0
+
+
+def highest_rated(track, _history):
+    """Returns the rating of the track."""
+    return track.rating or 0
+
+
+def recently_added(track, _history):
+    """Returns the time the track was added to the library as a timestamp."""
+    added = getattr(track, 'date_added', None)
+    if added is None:
+        return 0
+    return calendar.timegm(added.utctimetuple())
+
+
+def least_recently_synced(track, history):
+    """Returns the negated timestamp of the last time the track was copied
+    onto the destination, so that tracks never synced come first.
+    """
+    return -history.get(track.persistent_id, 0)
+
+
+# The policies are called with the track and the sync history of the
+# destination, which only least_recently_synced uses.
+POLICIES = {'highest_rated': highest_rated,
+            'least_recently_synced': least_recently_synced,
+            'most_played': most_played,
+            'recently_added': recently_added}
+
+
+class TrackQueue(object):
+    """Priority queue of tracks ordered by a policy from POLICIES, highest
+    priority first and in library order for equal priorities. The queue is
+    heapified in linear time and only the popped tracks are ordered, so
+    popping K of N tracks costs O(N + K log N) instead of a full sort. How
+    many tracks fit depends on their sizes in priority order, so K isn't
+    known beforehand and all N candidates are kept. The size of the smallest
+    track left is kept in a second heap, from which popped tracks are removed
+    lazily.
+    """
+
+    def __init__(self, tracks, policy, history=None):
+        key = POLICIES[policy]
+        history = history or {}
+        self.heap = [(-key(track, history), position, track)
+                     for position, track in enumerate(tracks)]
+        heapq.heapify(self.heap)
+
+        self._popped = set()
+        self._sizes = [(x[2].size, x[1]) for x in self.heap]
+        heapq.heapify(self._sizes)
+
+    def __len__(self):
+        return len(self.heap)
+
+    @property
+    def smallest(self):
+        """Returns the size of the smallest track left in the queue, or 0 if
+        the queue is empty.
+        """
+        while self._sizes and self._sizes[0][1] in self._popped:
+            heapq.heappop(self._sizes)
+        return self._sizes[0][0] if self._sizes else 0
+
+    def pop(self):
+        """Removes and returns the track with the highest priority."""
+        _, position, track = heapq.heappop(self.heap)
+        self._popped.add(position)
+        return track
+
+    def remaining(self):
+        """Returns the tracks left in the queue in no particular order and
+        empties the queue.
+        """
+        tracks = [x[2] for x in self.heap]
+        self.heap = []
+        self._popped = set()
+        self._sizes = []
+        return tracks
@@ -0,0 +1,96 @@
+"""
+Provides opt-in profiling of the sync phases with cProfile and tracemalloc.
+"""
+
+import cProfile
+import functools
+import json
+import os
+import os.path
+import threading
+import time
+import tracemalloc
+from .constants import (DEFAULT_PROFILES_FOLDER_PATH, PROFILE_ENVIRONMENT_KEY,
+                        PROFILE_MODES)
+
+_active = threading.local()
+
+
+def profile_modes(config):
+    """Returns the set of enabled profiling modes, 'cprofile' and/or
+    'tracemalloc'. The HIBIKI_PROFILE environment variable takes precedence
+    over the profile attribute of the config. The value 'all' or '1' enables
+    both modes.
+    """
+    value = os.environ.get(PROFILE_ENVIRONMENT_KEY) or config.profile
+    if not value:
+        return set()
+    modes = set()
+    for mode in value.lower().split(','):
+        mode = mode.strip()
+        if mode in ('1', 'all', 'true'):
+            modes.update(PROFILE_MODES)
+        elif mode in PROFILE_MODES:
+            modes.add(mode)
+    return modes
+
+
+def profiled(phase):
+    """Decorator for Hibiki methods that profiles the method as the given phase
+    if profiling is enabled. The cProfile statistics are saved as
+    <timestamp>-<phase>.prof and the wall time and peak memory figures as
+    <timestamp>-<phase>.json in the .hibiki/profiles folder of the destination.
+    Phases ran inside another profiled phase are not profiled separately.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            modes = profile_modes(self.config)
+            if (not modes or getattr(_active, 'phase', None)
+                    or not self.config.destination):
+                return function(self, *args, **kwargs)
+            _active.phase = phase
+            try:
+                return _run_profiled(self, phase, modes, function, args,
+                                     kwargs)
+            finally:
+                _active.phase = None
+        return wrapper
+    return decorator
+
+
+def _run_profiled(hibiki, phase, modes, function, args, kwargs):
+    """Runs the function with the enabled profilers and writes the results
+    into the profiles folder of the destination.
+    """
+    folder = os.path.join(hibiki.config.destination,
+                          DEFAULT_PROFILES_FOLDER_PATH)
+    os.makedirs(folder, exist_ok=True)
+    now = time.time()
+    name = os.path.join(folder, '{}{:03d}-{}'.format(
+        time.strftime('%Y%m%dT%H%M%S.', time.localtime(now)),
+        int(now * 1000) % 1000, phase))
+    profile = cProfile.Profile() if 'cprofile' in modes else None
+    tracing = 'tracemalloc' in modes and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if profile:
+        profile.enable()
+    try:
+        return function(hibiki, *args, **kwargs)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(name + '.prof')
+        data = {'phase': phase, 'seconds': time.perf_counter() - start}
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            data['current_bytes'] = current
+            data['peak_bytes'] = peak
+            data['top'] = [str(x) for x in
+                           snapshot.statistics('lineno')[:25]]
+        with open(name + '.json', 'w') as file:
+            json.dump(data, file, indent=2)
@@ -0,0 +1,107 @@
+"""
+Provides helpers for scanning directory trees with os.scandir.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+import os.path
+
+
+def scan_directory(path):
+    """Returns a tuple containing a dictionary of the file names and sizes and
+    a list of the subdirectory paths found directly in the path. Entries
+    starting with '.' are ignored.
+    """
+    files = {}
+    directories = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name[0] == '.':
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+            elif entry.is_file():
+                files[entry.name] = entry.stat().st_size
+    return files, directories
+
+
+def scan_tree(root, max_workers=4):
+    """Walks through the directory tree under root, scanning subdirectories in
+    parallel, and returns a dictionary of the relative file paths and sizes.
+    Entries starting with '.' are ignored.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(scan_directory, root): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory = pending.pop(future)
+                files, directories = future.result()
+                relative = os.path.relpath(directory, root)
+                for name, size in files.items():
+                    results[os.path.normpath(os.path.join(relative,
+                                                          name))] = size
+                for path in directories:
+                    pending[executor.submit(scan_directory, path)] = path
+    return results
+
+
+def scan_music_directory(path, extensions, cached=None):
+    """Returns a [modification time, files, subdirectory names] list for the
+    directory, where files is a list of [name, size, modification time]
+    lists of the files with one of the given extensions. If the cached list
+    has the same modification time as the directory, it is returned without
+    listing the directory. Entries starting with '.' are ignored.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    if cached is not None and cached[0] == mtime:
+        return cached
+    files = []
+    directories = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name[0] == '.':
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.name)
+            elif os.path.splitext(entry.name)[1].lower() in extensions and \
+                    entry.is_file():
+                stat = entry.stat()
+                files.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    return [mtime, sorted(files), sorted(directories)]
+
+
+def scan_music_tree(root, extensions, cache=None, max_workers=4):
+    """Walks through the directory tree under root like scan_tree(), but only
+    collects the files with the given extensions and reuses the entries of
+    the directories that haven't changed since the cache was made. Returns a
+    dictionary of the relative file paths and (size, modification time)
+    tuples and the new cache, a dictionary of the scan_music_directory()
+    results keyed by the relative directory paths.
+    """
+    cache = cache or {}
+    results = {}
+    scanned = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(scan_music_directory, root, extensions,
+                                   cache.get('.')): '.'}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                relative = pending.pop(future)
+                try:
+                    entry = future.result()
+                except FileNotFoundError:
+                    continue
+                scanned[relative] = entry
+                for name, size, mtime in entry[1]:
+                    path = os.path.normpath(os.path.join(relative, name))
+                    results[path] = (size, mtime)
+                for name in entry[2]:
+                    path = os.path.normpath(os.path.join(relative, name))
+                    future = executor.submit(
+                        scan_music_directory, os.path.join(root, path),
+                        extensions, cache.get(path))
+                    pending[future] = path
+    return results, scanned
@@ -0,0 +1,126 @@
+"""
+Provides parallel parsing of the tracks in large iTunes Library.xml files.
+The Tracks section of the memory-mapped file is split into shards at the
+boundaries of the track entries and the shards are decoded in a process pool.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import os
+from xml.etree import ElementTree
+from .constants import SHARDS_PER_WORKER
+
+TRACKS_KEY = b'<key>Tracks</key>'
+PLAYLISTS_KEY = b'<key>Playlists</key>'
+
+Node = namedtuple('Node', ('tag', 'text'))
+Node.__doc__ = """Decoded plist element with the tag and text attributes of an
+ElementTree element, so that it can be used in place of one.
+"""
+
+
+def tracks_section(buffer):
+    """Returns a (start, end) tuple of the offsets of the contents of the
+    Tracks dictionary in the file, or None if the section cannot be found. The
+    dictionary has to be followed by the playlists, as in files written by
+    iTunes.
+    """
+    key = buffer.find(TRACKS_KEY)
+    if key < 0:
+        return None
+    opening = buffer.find(b'<dict', key)
+    playlists = buffer.find(PLAYLISTS_KEY, key)
+    if opening < 0 or playlists < 0:
+        return None
+    start = buffer.find(b'>', opening) + 1
+    if buffer[start - 2:start] == b'/>':
+        return (start, start)
+    end = buffer.rfind(b'</dict>', start, playlists)
+    if end < 0:
+        return None
+    return (start, end)
+
+
+def shard_boundaries(buffer, start, end, count):
+    """Returns a list of (start, end) tuples splitting the contents of the
+    Tracks dictionary into at most count shards. Every shard ends after the
+    closing tag of a track dictionary, which are never nested.
+    """
+    cuts = [start]
+    for index in range(1, count):
+        target = start + (end - start) * index // count
+        if target <= cuts[-1]:
+            continue
+        closing = buffer.find(b'</dict>', target, end)
+        if closing < 0:
+            break
+        cuts.append(closing + len(b'</dict>'))
+    cuts.append(end)
+    return [(x, y) for x, y in zip(cuts, cuts[1:]) if y > x]
+
+
+def decode_shard(path, start, end):
+    """Decodes the track entries between the offsets of the file into a list
+    of alternating key Node objects and lists of Node objects, in the same
+    layout as the children of the Tracks element. Identical nodes are shared,
+    which keeps the result small to send between processes.
+    """
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            data = buffer[start:end]
+    root = ElementTree.fromstring(b'<dict>' + data + b'</dict>')
+    nodes = {}
+
+    def node(element):
+        key = (element.tag, element.text)
+        if key not in nodes:
+            nodes[key] = Node(element.tag, element.text)
+        return nodes[key]
+
+    return [[node(x) for x in element] if element.tag == 'dict'
+            else node(element) for element in root]
+
+
+def parse_library(path, workers):
+    """Parses the iTunes Library.xml file with the tracks decoded by a pool of
+    worker processes. Returns a tuple of the root dictionary element, without
+    the tracks, and the list of the decoded track entries. Returns None if the
+    file isn't laid out as expected, in which case it should be parsed
+    serially.
+    """
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            section = tracks_section(buffer)
+            if section is None:
+                return None
+            start, end = section
+            shards = shard_boundaries(buffer, start, end,
+                                      workers * SHARDS_PER_WORKER)
+            header = buffer[:start] + buffer[end:]
+    try:
+        root = ElementTree.fromstring(header)[0]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(decode_shard, [path] * len(shards),
+                                   [x[0] for x in shards],
+                                   [x[1] for x in shards])
+            tracks = [x for result in results for x in result]
+    except ElementTree.ParseError:
+        return None
+    return root, tracks
+
+
+def default_workers(path, threshold):
+    """Returns the number of worker processes to use for parsing the file:
+    one for every CPU available to the process for files of at least
+    threshold bytes, and 1 otherwise.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 1
+    if size < threshold:
+        return 1
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
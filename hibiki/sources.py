@@ -0,0 +1,127 @@
+"""
+Provides the interface of the libraries tracks are synced from.
+"""
+
+import os.path
+from xml.etree import ElementTree
+
+
+class LibrarySource(object):
+    """Base class for the libraries tracks are synced from. Subclasses
+    provide the tracks with tracks, track_count and track_at() and may provide
+    playlists; the rest is built on top of those. The tracks need to have the
+    attributes of iTunesTrack used by the sync rules and the layout, and the
+    library needs a music_folder.
+    """
+
+    music_folder = None
+    path = None
+    persistent_id = None
+
+    def __init__(self):
+        self._index = None
+
+    @property
+    def all_albums(self):
+        """Returns an alphabetical list of strings containing all available
+        albums in the library.
+        """
+        return self._get_all_track_info('album')
+
+    @property
+    def all_artists(self):
+        """Returns an alphabetical list of strings containing all available
+        artists in the library.
+        """
+        return self._get_all_track_info('artist')
+
+    @property
+    def all_genres(self):
+        """Returns an alphabetical list of strings containing all available
+        genres in the library.
+        """
+        return self._get_all_track_info('genre')
+
+    @property
+    def all_playlists(self):
+        """Returns an alphabetical list of strings containing all available
+        playlists in the library.
+        """
+        playlists = set()
+        for playlist in self.playlists:
+            playlists.add(playlist.name)
+        return sorted(list(playlists), key=lambda x: x.lower())
+
+    @property
+    def index(self):
+        """Returns a dictionary of the positions of the tracks keyed by their
+        persistent IDs. The dictionary is built on first access.
+        """
+        if self._index is None:
+            self._index = {x.persistent_id: y
+                           for y, x in enumerate(self.tracks)}
+        return self._index
+
+    @property
+    def playlists(self):
+        """Generator that returns the playlists of the library. Libraries
+        without playlists return nothing.
+        """
+        return iter(())
+
+    @property
+    def track_count(self):
+        """Returns the number of tracks in the library."""
+        raise NotImplementedError
+
+    @property
+    def tracks(self):
+        """Generator that returns every track in the library in order."""
+        raise NotImplementedError
+
+    def track_at(self, position):
+        """Returns the track in the given position in the library."""
+        raise NotImplementedError
+
+    def track_by_persistent_id(self, persistent_id):
+        """Returns track for persistent ID. If track is not found, None is
+        returned.
+        """
+        if persistent_id not in self.index:
+            return None
+        return self.track_at(self.index[persistent_id])
+
+    def tracks_by_persistent_ids(self, persistent_ids):
+        """Generator that returns the tracks for the given persistent IDs in
+        the order they appear in the library. Unknown IDs are skipped.
+        """
+        index = self.index
+        for position in sorted(index[x] for x in persistent_ids
+                               if x in index):
+            yield self.track_at(position)
+
+    def _get_all_track_info(self, name):
+        items = set()
+        for track in self.tracks:
+            item = getattr(track, name)
+            if item:
+                items.add(item)
+        return sorted(list(items), key=lambda x: x.lower())
+
+
+def open_library(path, workers=None, cache_path=None):
+    """Returns the LibrarySource for the path: a DirectorySource scanning the
+    directory if the path is a directory, with its scan cache in cache_path,
+    and an iTunesLibrary parsed with the given number of workers otherwise.
+    Raises InvalidConfigError if the iTunes Library.xml file cannot be parsed.
+    """
+    if os.path.isdir(path):
+        from .directory import DirectorySource
+        return DirectorySource(path, cache_path=cache_path)
+    from .itunes import iTunesLibrary
+    try:
+        return iTunesLibrary(path, workers=workers)
+    except ElementTree.ParseError as error:
+        from .exceptions import InvalidConfigError
+        raise InvalidConfigError(
+            message='Library cannot be parsed: {}'.format(error))
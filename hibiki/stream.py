@@ -0,0 +1,163 @@
+"""
+Provides compact track records and an incremental parser for the iTunes
+Library.xml file, used by the streaming sync pipeline.
+"""
+
+import json
+import tempfile
+from os.path import basename, join
+from xml.etree import ElementTree
+from .itunes import clean_path
+
+TRACK_KEYS = {'Album': 'album', 'Album Artist': 'album_artist',
+              'Artist': 'artist', 'Composer': 'composer',
+              'Disc Count': 'disc_count', 'Disc Number': 'disc_number',
+              'Genre': 'genre', 'Location': 'location', 'Name': 'name',
+              'Persistent ID': 'persistent_id', 'Play Count': 'play_count',
+              'Rating': 'rating', 'Size': 'size', 'Track Count': 'track_count',
+              'Track ID': 'track_id', 'Track Number': 'track_number',
+              'Year': 'year'}
+ZERO_DEFAULTS = {'disc_count', 'disc_number', 'play_count', 'rating',
+                 'track_count', 'track_number'}
+
+
+class TrackRecord(object):
+    # pylint: disable=too-few-public-methods
+    """Compact representation of a track with only the attributes used for
+    filtering, planning and copying. Has the same attribute names as
+    iTunesTrack, so it can be used in place of one.
+    """
+
+    __slots__ = tuple(sorted(TRACK_KEYS.values())) + ('music_folder',)
+
+    def __init__(self, music_folder=None, **values):
+        self.music_folder = music_folder
+        for name in TRACK_KEYS.values():
+            default = 0 if name in ZERO_DEFAULTS else None
+            setattr(self, name, values.get(name, default))
+        if self.location:
+            self.location = clean_path(self.location)
+
+    @property
+    def filename(self):
+        """Returns just the filename from the location information."""
+        return basename(self.location)
+
+    @property
+    def path(self):
+        """Returns the path to the track."""
+        return join(self.music_folder, self.location)
+
+    def serialize(self):
+        """Returns the record as a list of JSON serializable values."""
+        return [getattr(self, x) for x in TrackRecord.__slots__]
+
+    @classmethod
+    def deserialize(cls, values):
+        """Creates a record from the list returned by serialize()."""
+        record = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, values):
+            setattr(record, name, value)
+        return record
+
+
+def _value(element):
+    """Returns the Python value of a plist value element."""
+    if element.tag == 'integer':
+        return int(element.text)
+    if element.tag in ('true', 'false'):
+        return element.tag == 'true'
+    return element.text
+
+
+def iter_records(path):
+    """Generator that parses the iTunes Library.xml file incrementally and
+    yields a TrackRecord for every track with a location, in library order.
+    Parsed elements are discarded right away, so memory use doesn't grow with
+    the size of the library. Parsing stops at the playlists. Raises
+    InvalidConfigError if the file cannot be parsed.
+    """
+    try:
+        yield from _iter_records(path)
+    except ElementTree.ParseError as error:
+        from .exceptions import InvalidConfigError
+        raise InvalidConfigError(
+            message='Library cannot be parsed: {}'.format(error))
+
+
+def _iter_records(path):
+    """Performs the parsing for iter_records()."""
+    depth = 0
+    key = None
+    music_folder = None
+    tracks = None
+    for event, element in ElementTree.iterparse(path, events=('start',
+                                                              'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 3 and key == 'Tracks' and element.tag == 'dict':
+                tracks = element
+            continue
+        depth -= 1
+        if depth == 2 and element.tag == 'key':
+            key = element.text
+            if key == 'Playlists':
+                return
+        elif depth == 2 and key == 'Music Folder':
+            music_folder = clean_path(element.text)
+        elif depth == 3 and element.tag == 'dict' and tracks is not None:
+            values = {}
+            for name, value in zip(element[::2], element[1::2]):
+                if name.text in TRACK_KEYS:
+                    values[TRACK_KEYS[name.text]] = _value(value)
+            tracks.clear()
+            if values.get('location'):
+                if 'rating' in values:
+                    values['rating'] = values['rating'] / 5
+                yield TrackRecord(music_folder, **values)
+
+
+class RecordBuffer(object):
+    """First in, first out buffer of TrackRecord objects that keeps at most
+    capacity records in memory and spills the rest into a temporary file.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+        self._file = None
+        self._memory = []
+        self._spilled = 0
+
+    def __len__(self):
+        return len(self._memory) + self._spilled
+
+    def append(self, record):
+        """Adds the record to the end of the buffer."""
+        if len(self._memory) < self.capacity:
+            self._memory.append(record)
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile('w+')
+        self._file.write(json.dumps(record.serialize()) + '\n')
+        self._spilled += 1
+
+    def close(self):
+        """Removes the temporary file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._memory = []
+        self._spilled = 0
+
+    def drain(self):
+        """Generator that yields and removes all the buffered records in the
+        order they were added.
+        """
+        memory, self._memory = self._memory, []
+        yield from memory
+        if self._file is not None:
+            self._file.seek(0)
+            for line in self._file:
+                yield TrackRecord.deserialize(json.loads(line))
+            self.close()
@@ -0,0 +1,244 @@
+"""
+Provides the file copy routine used for writing tracks onto destinations.
+"""
+
+import os
+import os.path
+import threading
+import time
+from .constants import COPY_BLOCK_SIZE, FICLONE, FSYNC_POLICIES
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class TokenBucket(object):
+    """Token bucket that limits the rate of bytes passing through it to rate
+    bytes per second, allowing bursts of up to burst bytes. Can be shared by
+    several threads.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.burst = burst or rate
+        self.rate = rate
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def consume(self, amount):
+        """Takes the given number of bytes from the bucket, sleeping until
+        they are available. Returns the number of seconds slept.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def _advise(fd, offset, length, advice):
+    """Gives the kernel a posix_fadvise hint about the file descriptor if the
+    platform supports it. Failures are ignored, as the hints are optional.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice))
+    except (AttributeError, OSError):
+        pass
+
+
+class CopyPolicy(object):
+    """Settings for how files are copied onto the destination. With a
+    bandwidth limit in bytes per second, reads from the sources pass through a
+    TokenBucket shared by all the copies made with the policy. The fsync
+    policy is one of FSYNC_POLICIES: 'none' leaves flushing to the operating
+    system, 'interval' flushes the files being written whenever
+    fsync_interval bytes have been written since the last flush, counting
+    all the copies made with the policy, and 'file' flushes every file before
+    it is closed. Pages of the source files are
+    dropped from the page cache after reading, and pages of the destination
+    files after flushing, so that syncs don't push everything else out of it.
+    """
+
+    def __init__(self, bandwidth_limit=None, fsync='none',
+                 fsync_interval=None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('Unknown fsync policy: {}'.format(fsync))
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.limiter = None
+        if bandwidth_limit:
+            self.limiter = TokenBucket(bandwidth_limit)
+
+        self._lock = threading.Lock()
+        self._unflushed = 0
+
+    @classmethod
+    def from_configs(cls, configs):
+        """Returns the strictest CopyPolicy that satisfies the transfer
+        settings of all the given HibikiConfig objects: the lowest bandwidth
+        limit, the most frequent fsync policy and the shortest interval.
+        """
+        limits = [x.bandwidth_limit for x in configs if x.bandwidth_limit]
+        fsync = max((x.fsync for x in configs), key=FSYNC_POLICIES.index,
+                    default='none')
+        intervals = [x.fsync_interval for x in configs if x.fsync_interval]
+        return cls(bandwidth_limit=min(limits) * 1024 * 1024
+                   if limits else None,
+                   fsync=fsync,
+                   fsync_interval=min(intervals) * 1024 * 1024
+                   if intervals else None)
+
+    def read(self, file, size):
+        """Reads a block of at most size bytes from the source file, waiting
+        for the bandwidth limit, and drops the read pages from the cache. Only
+        the bytes actually read count against the limit.
+        """
+        block = file.read(size)
+        if block:
+            _advise(file.fileno(), file.tell() - len(block), len(block),
+                    'POSIX_FADV_DONTNEED')
+            if self.limiter:
+                self.limiter.consume(len(block))
+        return block
+
+    def flush(self, file):
+        """Writes the file onto the disk and drops its pages from the cache."""
+        file.flush()
+        os.fsync(file.fileno())
+        _advise(file.fileno(), 0, 0, 'POSIX_FADV_DONTNEED')
+
+    def written(self, size):
+        """Called before writing size bytes into the destination files.
+        Returns True if the files have to be flushed after the write, which
+        with the 'interval' policy is when fsync_interval bytes have been
+        written since the last flush, including the bytes of earlier files.
+        """
+        if self.fsync != 'interval' or not self.fsync_interval:
+            return False
+        with self._lock:
+            self._unflushed += size
+            if self._unflushed < self.fsync_interval:
+                return False
+            self._unflushed = 0
+        return True
+
+    def close(self, file):
+        """Flushes the destination file if the policy requires it and closes
+        it.
+        """
+        if self.fsync == 'file':
+            self.flush(file)
+        file.close()
+
+
+def _discard(file, path):
+    """Closes the file object and removes the partially written file."""
+    file.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def clone_file(source, destination):
+    """Creates the destination as a reflink clone of the source with the
+    FICLONE ioctl, sharing the data blocks of the source until either file is
+    modified. Raises OSError if the file system or the platform doesn't
+    support cloning, in which case nothing is left written.
+    """
+    if fcntl is None:
+        raise OSError('Cloning is not supported on this platform')
+    with open(source, 'rb') as fin:
+        fout = open(destination, 'xb')
+        try:
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+        except OSError:
+            _discard(fout, destination)
+            raise
+        fout.close()
+
+
+def link_file(source, destination):
+    """Materializes the source in the destination path without copying its
+    data, trying a reflink clone first and a hard link after that. A file
+    already in the destination path is removed first, so that a hard link to
+    a source file is never written through. Returns 'reflink' or 'hardlink'
+    depending on the method that worked, or None if neither did. Raises
+    OSError if the existing file cannot be removed.
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        clone_file(source, destination)
+    except OSError:
+        pass
+    else:
+        return 'reflink'
+    try:
+        os.link(source, destination)
+    except OSError:
+        return None
+    return 'hardlink'
+
+
+def source_size(path):
+    """Returns the size of the source file, opening it to make sure that it
+    can be read. Raises OSError if the file is missing or cannot be read.
+    """
+    with open(path, 'rb') as file:
+        return os.fstat(file.fileno()).st_size
+
+
+def copy_file(source, destinations, block_size=COPY_BLOCK_SIZE, policy=None):
+    """Copies the source file into all of the destination paths while reading
+    the source only once. A destination that fails doesn't stop the copy to the
+    others. Returns a dictionary of the failed destination paths and their
+    exceptions. Partially written files are removed. Raises OSError if the
+    source cannot be read, in which case nothing is left written. The optional
+    CopyPolicy sets the bandwidth limit and the fsync policy.
+    """
+    errors = {}
+    outputs = {}
+    policy = policy or CopyPolicy()
+    with open(source, 'rb') as fin:
+        _advise(fin.fileno(), 0, 0, 'POSIX_FADV_SEQUENTIAL')
+        for path in destinations:
+            try:
+                outputs[path] = open(path, 'wb')
+            except OSError as error:
+                errors[path] = error
+        try:
+            while outputs:
+                block = policy.read(fin, block_size)
+                if not block:
+                    break
+                flush = policy.written(len(block) * len(outputs))
+                for path, fout in list(outputs.items()):
+                    try:
+                        fout.write(block)
+                        if flush:
+                            policy.flush(fout)
+                    except OSError as error:
+                        errors[path] = error
+                        del outputs[path]
+                        _discard(fout, path)
+            for path, fout in list(outputs.items()):
+                try:
+                    policy.close(fout)
+                except OSError as error:
+                    errors[path] = error
+                    _discard(fout, path)
+                del outputs[path]
+        except OSError:
+            for path, fout in outputs.items():
+                _discard(fout, path)
+            raise
+    return errors
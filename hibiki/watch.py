@@ -0,0 +1,190 @@
+"""
+Provides a class for waiting for changes to the iTunes Library.xml file, used
+for continuous syncing.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import os.path
+import select
+import struct
+import threading
+import time
+from .constants import WATCH_DEBOUNCE_DELAY, WATCH_POLL_INTERVAL
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _inotify_init(directory):
+    """Returns an inotify file descriptor watching the directory for written,
+    created and moved in files. Returns None if inotify is not available.
+    """
+    name = ctypes.util.find_library('c')
+    if not name:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        init = libc.inotify_init1
+        add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = init(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if add_watch(fd, os.fsencode(directory), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class LibraryWatcher(object):
+    """Waits for the file in path to change. Uses inotify on the directory of
+    the file where available and polls the size and modification time of the
+    file otherwise. Consecutive changes are debounced so that a file being
+    rewritten only causes one change once the writes have settled. Waiting
+    can be interrupted from another thread with stop().
+    """
+
+    def __init__(self, path, debounce=WATCH_DEBOUNCE_DELAY,
+                 interval=WATCH_POLL_INTERVAL):
+        self.debounce = debounce
+        self.interval = interval
+        self.path = path
+
+        self._fd = _inotify_init(os.path.dirname(os.path.abspath(path)))
+        self._last = self._state()
+        self._seen = self._last
+        self._stopped = threading.Event()
+        self._wakeup = os.pipe() if self._fd is not None else None
+
+    @property
+    def uses_inotify(self):
+        """Returns True if inotify is used instead of polling."""
+        return self._fd is not None
+
+    def _state(self):
+        """Returns the size and modification time of the file, or None if the
+        file doesn't exist.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _read_inotify(self, timeout):
+        """Waits for inotify events for at most timeout seconds, or until
+        stop() is called. Returns True if any of the events concerned the
+        watched file.
+        """
+        readable, _, _ = select.select([self._fd, self._wakeup[0]], [], [],
+                                       timeout)
+        if self._fd not in readable:
+            return False
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as error:
+            if error.errno == errno.EAGAIN:
+                return False
+            raise
+        name = os.fsencode(os.path.basename(self.path))
+        offset = 0
+        matched = False
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            start = offset + EVENT_HEADER.size
+            if data[start:start + length].rstrip(b'\0') == name:
+                matched = True
+            offset = start + length
+        return matched
+
+    def _poll(self, timeout):
+        """Polls the file for at most timeout seconds, or until stop() is
+        called. Returns True if the size or modification time changed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._stopped.is_set():
+            state = self._state()
+            if state != self._seen:
+                self._seen = state
+                return True
+            if deadline is None:
+                delay = self.interval
+            else:
+                delay = min(self.interval, deadline - time.monotonic())
+                if delay <= 0:
+                    return False
+            self._stopped.wait(delay)
+        return False
+
+    def _wait_event(self, timeout):
+        """Waits for at most timeout seconds, or indefinitely if timeout is
+        None, for a change to the file. Returns True if one was seen and
+        False if the timeout passed or stop() was called.
+        """
+        if self._fd is None:
+            return self._poll(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._stopped.is_set():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+            if self._read_inotify(remaining):
+                return True
+        return False
+
+    def close(self):
+        """Closes the inotify file descriptor and the wakeup pipe. Should only
+        be called once no thread is waiting anymore.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._wakeup is not None:
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+
+    def stop(self):
+        """Makes wait() return False in every thread waiting in it, now and
+        in the future. Can be called from any thread.
+        """
+        self._stopped.set()
+        if self._wakeup is not None:
+            try:
+                os.write(self._wakeup[1], b'\0')
+            except OSError:
+                pass
+
+    def wait(self, timeout=None):
+        """Blocks until the file has changed and no further changes have
+        happened within the debounce delay. Returns True if the file changed
+        or False if timeout seconds passed without a change or if stop() was
+        called.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            if not self._wait_event(remaining):
+                return False
+            while self._wait_event(self.debounce):
+                pass
+            if self._stopped.is_set():
+                return False
+            state = self._state()
+            if state is not None and state != self._last:
+                self._last = state
+                self._seen = state
+                return True